@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from dense_matcher import DenseMatcher
+from matching import SimilarityResults
+from utils import (
+    calculate_list_scores,
+    evaluate_rankings,
+    read_excel_cached,
+)
+
+
+def make_output_csv(df: pd.DataFrame, df_faq_users: pd.DataFrame) -> pd.DataFrame:
+    """Process output"""
+
+    df = pd.concat([df_faq_users[["n_wpp_questions", "wpp_to_faq_annotation"]].dropna(how="all"), df], axis=1)
+
+    df = df.drop("wpp_question", axis=1)
+    df = df.query("n_wpp_questions != -1")
+
+    return df
+
+
+def main():
+    df_faq_users = read_excel_cached(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+        fix_table=True,
+    )
+    wpp_questions = df_faq_users["wpp_question"].dropna().tolist()
+    faq = df_faq_users["pergunta_faq"].dropna().tolist()
+
+    timings = []
+    results = SimilarityResults(indices={}, scores={})
+    for name, hnsw in (("dense", False), ("dense_hnsw", True)):
+        matcher = DenseMatcher(hnsw=hnsw)
+        matcher.load_index(faq, cache_dir="../../../data/.cache/dense")
+
+        start = time.perf_counter()
+        method_results = matcher.match(wpp_questions, faq, k=3, name=name)
+        seconds = time.perf_counter() - start
+
+        results.indices.update(method_results.indices)
+        results.scores.update(method_results.scores)
+        timings.append(
+            {
+                "similarity_method": name,
+                "seconds": round(seconds, 4),
+                "ms_per_question": round(1000 * seconds / len(wpp_questions), 3),
+            }
+        )
+
+    methods_results = results.to_wide_frame(wpp_questions)
+    methods_results = make_output_csv(methods_results, df_faq_users)
+    methods_results.to_csv("dense_results.csv", index=False)
+
+    methods_scores = calculate_list_scores(methods_results)
+    methods_scores = methods_scores.merge(pd.DataFrame(timings), on="similarity_method")
+    methods_scores.to_csv("dense_scores.csv", index=False)
+
+    ranking_scores, _ = evaluate_rankings(methods_results)
+    ranking_scores.to_csv("dense_ranking_scores.csv", index=False)
+
+
+main()
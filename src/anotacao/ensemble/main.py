@@ -4,26 +4,80 @@ import sys
 import pandas as pd
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from rapidfuzz import fuzz
 
-from utils import calculate_scores
+from faq_index import load_faq_index
+from fusion import FUSION_METHODS, fused_results, grid_search
+from matching import SimilarityResults, score_matrices, top_k
+from utils import calculate_list_scores, read_excel_cached
+
+
+def make_output_csv(df: pd.DataFrame, df_faq_users: pd.DataFrame) -> pd.DataFrame:
+    """Process output"""
+
+    df = pd.concat(
+        [df_faq_users[["n_wpp_questions", "wpp_to_faq_annotation"]].dropna(how="all"), df], axis=1
+    )
+
+    df = df.drop("wpp_question", axis=1)
+    df = df.query("n_wpp_questions != -1")
+
+    return df
 
 
 def main():
-    anotacao_output = pd.read_csv("../anotacao_output.csv")
-
-    columns_to_check = [
-        "partial_ratio_question",
-        "token_set_ratio_question",
-        "partial_token_sort_ratio_question",
-        "token_ratio_question",
-        "token_sort_ratio_question",
-    ]
-
-    anotacao_output["ensemble_question"] = (
-        anotacao_output[columns_to_check].mode(axis=1)[0].astype(int)
+    df_faq_users = read_excel_cached(
+        io="../../../data/Perguntas_chatbot - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+        fix_table=True,
+    )
+    faq_index = load_faq_index(
+        io="../../../data/Perguntas_chatbot - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+    )
+    wpp_questions = faq_index.prepare_queries(df_faq_users["wpp_question"].dropna().tolist())
+
+    scoares = (
+        fuzz.partial_ratio,
+        fuzz.token_set_ratio,
+        fuzz.partial_token_sort_ratio,
+        fuzz.token_ratio,
+        fuzz.token_sort_ratio,
+    )
+
+    # Keep only the annotated questions, aligned row by row with the score matrices
+    annotations = make_output_csv(pd.DataFrame({"wpp_question": wpp_questions}), df_faq_users)
+    annotations = annotations[annotations.index < len(wpp_questions)]
+
+    matrices = score_matrices(wpp_questions, faq_index.processed, scoares)
+    matrices = {name: matrix[annotations.index] for name, matrix in matrices.items()}
+
+    grid_report = pd.concat(
+        [grid_search(matrices, annotations, method=method) for method in FUSION_METHODS],
+        ignore_index=True,
     )
+    grid_report.to_csv("grid_search_ensemble.csv", index=False)
+
+    results = SimilarityResults(indices={}, scores={})
+    for name, matrix in matrices.items():
+        results.indices[name], results.scores[name] = top_k(matrix, 1)
+
+    for method, fusion in FUSION_METHODS.items():
+        best = grid_report[grid_report["method"] == method].iloc[0]
+        variants = {
+            f"{method}_ensemble": fusion(matrices),
+            f"{method}_tuned_ensemble": fusion(matrices, best[list(matrices)].to_dict()),
+        }
+        for name, fused in variants.items():
+            fused = fused_results(fused, name)
+            results.indices.update(fused.indices)
+            results.scores.update(fused.scores)
+
+    methods_results = results.to_wide_frame(annotations.index)
+    methods_results = methods_results.set_index(annotations.index).drop("wpp_question", axis=1)
+    anotacao_output = pd.concat([annotations, methods_results], axis=1)
 
-    scores = calculate_scores(anotacao_output)
+    scores = calculate_list_scores(anotacao_output)
 
     scores.to_csv("scores_ensemble.csv", index=False)
     anotacao_output.to_csv("anotacao_ensemble_output.csv", index=False)
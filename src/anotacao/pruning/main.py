@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from rapidfuzz import fuzz
+
+from faq_index import load_faq_index
+from inverted_index import InvertedIndex
+from matching import SimilarityResults, match_top_k
+from utils import (
+    calculate_list_scores,
+    read_excel_cached,
+)
+
+
+def make_output_csv(df: pd.DataFrame, df_faq_users: pd.DataFrame) -> pd.DataFrame:
+    """Process output"""
+
+    df = pd.concat(
+        [df_faq_users[["n_wpp_questions", "wpp_to_faq_annotation"]].dropna(how="all"), df], axis=1
+    )
+
+    df = df.drop("wpp_question", axis=1)
+    df = df.query("n_wpp_questions != -1")
+
+    return df
+
+
+def evaluate(
+    wpp_questions: list[str], results: SimilarityResults, df_faq_users: pd.DataFrame
+) -> pd.DataFrame:
+    """Accuracy of each similarity method against the annotated sheet"""
+
+    methods_results = results.to_wide_frame(wpp_questions)
+    methods_results = make_output_csv(methods_results, df_faq_users)
+
+    return calculate_list_scores(methods_results)[["similarity_method", "accuracy"]]
+
+
+def main():
+    df_faq_users = read_excel_cached(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+        fix_table=True,
+    )
+    faq_index = load_faq_index(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+    )
+    wpp_questions = faq_index.prepare_queries(df_faq_users["wpp_question"].dropna().tolist())
+
+    scoares = (
+        fuzz.ratio,
+        fuzz.partial_ratio,
+        fuzz.token_sort_ratio,
+        fuzz.token_set_ratio,
+        fuzz.partial_token_sort_ratio,
+        fuzz.partial_token_set_ratio,
+        fuzz.WRatio,
+    )
+
+    start = time.perf_counter()
+    results = match_top_k(wpp_questions, faq_index.processed, scoares, limit=3)
+    full_seconds = time.perf_counter() - start
+
+    baseline = evaluate(wpp_questions, results, df_faq_users)
+    baseline = baseline.rename(columns={"accuracy": "full_accuracy"})
+
+    inverted_index = InvertedIndex(faq_index)
+    report = []
+
+    for shortlist_size in (5, 10, 20, 40):
+        start = time.perf_counter()
+        candidates = inverted_index.shortlist(wpp_questions, shortlist_size)
+        results = match_top_k(
+            wpp_questions, faq_index.processed, scoares, limit=3, candidates=candidates
+        )
+        seconds = time.perf_counter() - start
+
+        shortlist_results = SimilarityResults(
+            indices={"shortlist": candidates}, scores={"shortlist": np.zeros(candidates.shape)}
+        )
+        scores = pd.concat(
+            [
+                evaluate(wpp_questions, results, df_faq_users),
+                evaluate(wpp_questions, shortlist_results, df_faq_users),
+            ]
+        )
+        scores = scores.merge(baseline, on="similarity_method", how="left")
+        scores.insert(0, "shortlist_size", shortlist_size)
+        scores["seconds"] = round(seconds, 4)
+        scores["speedup"] = round(full_seconds / seconds, 2)
+        report.append(scores)
+
+    report = pd.concat(report, ignore_index=True)
+    report["recall_delta"] = report["accuracy"] - report["full_accuracy"]
+    report.to_csv("pruning_report.csv", index=False)
+
+
+main()
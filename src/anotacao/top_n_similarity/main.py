@@ -4,13 +4,14 @@ import sys
 import pandas as pd
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
-from rapidfuzz import fuzz, process, utils
+from rapidfuzz import fuzz
 
+from faq_index import load_faq_index
+from matching import match_top_k
 from utils import (
     calculate_list_scores,
-    fix_excel_table,
-    process_similarity_results,
-    remove_stopwords,
+    evaluate_rankings,
+    read_excel_cached,
 )
 
 
@@ -28,14 +29,16 @@ def make_output_csv(df: pd.DataFrame, df_faq_users: pd.DataFrame) -> pd.DataFram
 
 
 def main():
-    df_faq_users = pd.read_excel(
+    df_faq_users = read_excel_cached(
         io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
         sheet_name="relacao_clean",
+        fix_table=True,
     )
-
-    df_faq_users = fix_excel_table(df_faq_users)
-    wpp_questions = remove_stopwords(df_faq_users["wpp_question"].dropna().tolist())
-    faq = remove_stopwords(df_faq_users["pergunta_faq"].dropna().tolist())
+    faq_index = load_faq_index(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+    )
+    wpp_questions = faq_index.prepare_queries(df_faq_users["wpp_question"].dropna().tolist())
 
     scoares = (
         fuzz.ratio,
@@ -47,28 +50,18 @@ def main():
         fuzz.WRatio,
     )
 
-    results = []
-
-    for i in wpp_questions:
-        results.append(
-            {
-                score.__name__: process.extract(
-                    i,
-                    faq,
-                    scorer=score,
-                    limit=3,
-                    processor=utils.default_process,
-                )
-                for score in scoares
-            }
-        )
-
-    metohds_results = process_similarity_results(wpp_questions, results)
+    results = match_top_k(wpp_questions, faq_index.processed, scoares, limit=3)
+
+    metohds_results = results.to_wide_frame(wpp_questions)
     metohds_results = make_output_csv(metohds_results, df_faq_users)
     metohds_results.to_csv("metohds_results.csv", index=False)
 
     methods_scores = calculate_list_scores(metohds_results)
     methods_scores.to_csv("scores.csv", index=False)
 
+    ranking_scores, ranking_hits = evaluate_rankings(metohds_results)
+    ranking_scores.to_csv("ranking_scores.csv", index=False)
+    ranking_hits.to_csv("ranking_hits.csv")
+
 
 main()
@@ -0,0 +1,576 @@
+import contextlib
+import itertools
+import multiprocessing
+import os
+import tempfile
+import warnings
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import Self
+
+import numpy as np
+import pandas as pd
+import torch
+from bert_score.utils import get_bert_embedding
+from rapidfuzz import fuzz
+from torch.nn.utils.rnn import pad_sequence
+
+from bert_score import BERTScorer
+from embedding_store import EmbeddingStore
+from faq_index import FaqIndex
+from matching import Scorer, SimilarityResults, match_top_k
+
+
+class BertScoreMatcher:
+    """BERTScore matcher that keeps one `BERTScorer` (model, tokenizer and IDF
+    weights) alive for the whole process instead of rebuilding it per call.
+
+    `quantize=True` swaps the model's Linear layers for dynamic int8 ones, a
+    CPU-only mode that trades some accuracy for faster inference. With
+    `store_dir`, FAQ embeddings are kept in an on-disk `EmbeddingStore` shared
+    by every run and process instead of being re-encoded each time."""
+
+    def __init__(
+        self,
+        lang: str = "pt",
+        model_type: str = "bert-base-multilingual-cased",
+        batch_size: int = 64,
+        device: str | None = None,
+        quantize: bool = False,
+        store_dir: str | None = None,
+    ):
+        if quantize and device not in (None, "cpu"):
+            raise ValueError(f"Dynamic int8 quantization only runs on CPU, got device {device!r}.")
+
+        self.batch_size = batch_size
+        self.quantize = quantize
+        self.scorer = BERTScorer(
+            model_type=model_type,
+            lang=lang,
+            batch_size=batch_size,
+            device="cpu" if quantize else device,
+        )
+
+        if quantize:
+            # int8 weights for every Linear layer, activations quantized on the fly
+            self.scorer._model = torch.ao.quantization.quantize_dynamic(
+                self.scorer._model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        # Same weights `BERTScorer.score` uses without IDF: uniform, except the
+        # [CLS] and [SEP] tokens, which take part in the matching but weigh 0.
+        tokenizer = self.scorer._tokenizer
+        self.idf_dict = defaultdict(lambda: 1.0)
+        self.idf_dict[tokenizer.sep_token_id] = 0
+        self.idf_dict[tokenizer.cls_token_id] = 0
+
+        self._embeddings: dict[str, tuple[torch.Tensor, torch.Tensor]] = {}
+        self.store = None if store_dir is None else EmbeddingStore.open(store_dir, self.model_key)
+
+    @property
+    def model_key(self) -> str:
+        """Identifies the embeddings this matcher produces: model, layer and quantization."""
+
+        suffix = "_int8" if self.quantize else ""
+        return f"{self.scorer.model_type}_L{self.scorer.num_layers}{suffix}"
+
+    def score_pairs(
+        self, cands: list[str], refs: list[str]
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """P, R and F1 of each (candidate, reference) pair with `BERTScorer.score`."""
+
+        return self.scorer.score(cands, refs, batch_size=self.batch_size)
+
+    def _encode(self, sentences: list[str]) -> dict[str, tuple[torch.Tensor, torch.Tensor]]:
+        """L2-normalized token embeddings and IDF weights normalized to sum 1 of
+        each sentence, the two inputs of BERTScore's greedy matching."""
+
+        encoded = {}
+        for start in range(0, len(sentences), self.batch_size):
+            batch = sentences[start : start + self.batch_size]
+            embeddings, masks, idf = get_bert_embedding(
+                batch,
+                self.scorer._model,
+                self.scorer._tokenizer,
+                self.idf_dict,
+                device=self.scorer.device,
+            )
+            embeddings = embeddings / embeddings.norm(dim=-1, keepdim=True)
+            embeddings, masks, idf = embeddings.cpu(), masks.cpu(), idf.cpu()
+
+            for i, sentence in enumerate(batch):
+                length = int(masks[i].sum())
+                weights = idf[i, :length]
+                encoded[sentence] = (
+                    embeddings[i, :length],
+                    weights / weights.sum() if length > 2 else torch.zeros_like(weights),
+                )
+
+        return encoded
+
+    def encode(self, sentences: list[str]) -> None:
+        """Encode and cache the sentences not seen yet, one forward pass per unique sentence.
+
+        With a store, only the sentences it lacks are encoded and appended to
+        it in input order, which keeps a FAQ contiguous on disk; a FAQ whose
+        entries ended up scattered among other texts is compacted (see
+        `EmbeddingStore.needs_compaction`)."""
+
+        if self.store is None:
+            new = sorted(set(sentences) - self._embeddings.keys(), key=len, reverse=True)
+            self._embeddings.update(self._encode(new))
+            return
+
+        # Other processes (the worker that encoded the FAQ, earlier runs) may
+        # have written to the store since it was opened
+        self.store.reload()
+        missing = self.store.missing(sentences)
+        if missing:
+            encoded = self._encode(sorted(missing, key=len, reverse=True))
+            self.store.add(
+                {sentence: tuple(tensor.numpy() for tensor in encoded[sentence]) for sentence in missing}
+            )
+
+        unique = list(dict.fromkeys(sentences))
+        if self.store.needs_compaction(unique):
+            self.store.compact(unique)
+
+    def _flat(self, sentences: list[str]) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """(T x D) token embeddings and (T,) weights of the sentences laid end to
+        end, and the (S + 1) offsets of each sentence in them.
+
+        Sentences served by the store come straight from its read-only memory
+        map, without a copy on CPU."""
+
+        if self.store is None:
+            embeddings, weights = zip(*(self._embeddings[sentence] for sentence in sentences), strict=True)
+            offsets = np.concatenate([[0], np.cumsum([len(w) for w in weights])])
+            embeddings, weights = torch.cat(embeddings), torch.cat(weights)
+        else:
+            embeddings, weights, offsets = self.store.flat(sentences)
+            with warnings.catch_warnings():
+                # Nothing writes into the memory map
+                warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+                embeddings, weights = torch.from_numpy(embeddings), torch.from_numpy(weights)
+
+        device = self.scorer.device
+        return embeddings.to(device), weights.to(device), torch.from_numpy(offsets).to(device)
+
+    def _padded(
+        self,
+        sentences: list[str],
+        encoded: dict[str, tuple[torch.Tensor, torch.Tensor]] | None = None,
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """(S x L x D) embeddings and (S x L) weights, zero-padded.
+
+        Zero vectors make the padded positions score a cosine of 0, as
+        `greedy_cos_idf` masks them."""
+
+        encoded = self._embeddings if encoded is None else encoded
+        embeddings, weights = zip(*(encoded[sentence] for sentence in sentences), strict=True)
+        device = self.scorer.device
+
+        return (
+            pad_sequence(embeddings, batch_first=True).to(device),
+            pad_sequence(weights, batch_first=True).to(device),
+        )
+
+    @staticmethod
+    def _greedy_f1(
+        hyp: torch.Tensor,
+        hyp_idf: torch.Tensor,
+        ref: torch.Tensor,
+        ref_idf: torch.Tensor,
+        offsets: torch.Tensor,
+    ) -> torch.Tensor:
+        """(n x m) F1 of BERTScore's greedy matching between every candidate and
+        every reference, computed with a single matrix product.
+
+        Candidates are zero-padded (n x L x D); the tokens of the m references
+        are laid end to end (T x D), reference r spanning offsets[r]:offsets[r + 1]."""
+
+        n_hyp, hyp_len, dim = hyp.shape
+        n_ref = len(offsets) - 1
+        segments = torch.repeat_interleave(torch.arange(n_ref, device=ref.device), offsets.diff())
+
+        # sim[n * L + i, t]: cosine between token i of candidate n and reference token t
+        sim = hyp.reshape(-1, dim) @ ref.T
+
+        word_precision = torch.zeros(len(sim), n_ref, dtype=sim.dtype, device=sim.device)
+        word_precision.index_reduce_(1, segments, sim, "amax", include_self=False)
+        P = torch.einsum("nim,ni->nm", word_precision.view(n_hyp, hyp_len, n_ref), hyp_idf)
+
+        word_recall = sim.view(n_hyp, hyp_len, -1).amax(dim=1) * ref_idf
+        R = torch.zeros(n_hyp, n_ref, dtype=sim.dtype, device=sim.device).index_add_(1, segments, word_recall)
+
+        return (2 * P * R / (P + R)).nan_to_num(0.0)
+
+    def f1_matrix(self, questions: list[str], faq: list[str], questions_per_block: int = 64) -> torch.Tensor:
+        """(N x M) BERTScore F1 matrix between questions (candidates) and FAQ
+        entries (references).
+
+        Every unique sentence is encoded once (N + M forward passes instead of
+        N x M) and the greedy matching of all pairs is computed with one matrix
+        product per block of `questions_per_block` questions. Matches
+        `BERTScorer.score` on the Cartesian product up to float rounding."""
+
+        self.encode(faq)
+        ref, ref_idf, offsets = self._flat(faq)
+        encoded = self._encode(list(dict.fromkeys(questions)))
+
+        blocks = []
+        with torch.no_grad():
+            for start in range(0, len(questions), questions_per_block):
+                hyp, hyp_idf = self._padded(questions[start : start + questions_per_block], encoded)
+                blocks.append(self._greedy_f1(hyp, hyp_idf, ref, ref_idf, offsets).cpu())
+
+        return torch.cat(blocks)
+
+    def iter_top_k(
+        self, questions: list[str], faq: list[str], k: int = 3, memory_budget_mb: float = 512
+    ) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+        """Yield `(start, indices, scores)` for consecutive blocks of questions,
+        with the (rows x k) 0-based indices and F1 scores of their best FAQ entries.
+
+        Only the FAQ embeddings are cached: questions are encoded `batch_size`
+        at a time and dropped once scored. Each batch is split into row and
+        FAQ-column blocks whose similarity tensor fits `memory_budget_mb`, and
+        a running top-k is kept per row, so peak memory does not grow with the
+        number of questions."""
+
+        self.encode(faq)
+        ref, ref_idf, offsets = self._flat(faq)
+        ref_len = int(offsets.diff().max())
+        k = min(k, len(faq))
+        budget = memory_budget_mb * 2**20 / ref.element_size()
+
+        with torch.no_grad():
+            for start in range(0, len(questions), self.batch_size):
+                batch = questions[start : start + self.batch_size]
+                hyp, hyp_idf = self._padded(batch, self._encode(list(dict.fromkeys(batch))))
+
+                pair_size = hyp.shape[1] * ref_len
+                cols = int(min(len(faq), max(1, budget // pair_size)))
+                rows = int(max(1, budget // (cols * pair_size)))
+
+                for row in range(0, len(batch), rows):
+                    block = slice(row, row + rows)
+                    best_scores = torch.full((len(hyp[block]), 0), -torch.inf, device=ref.device)
+                    best_indices = torch.zeros_like(best_scores, dtype=torch.long)
+
+                    for col in range(0, len(faq), cols):
+                        first, last = offsets[col], offsets[min(col + cols, len(faq))]
+                        F1 = self._greedy_f1(
+                            hyp[block],
+                            hyp_idf[block],
+                            ref[first:last],
+                            ref_idf[first:last],
+                            offsets[col : col + cols + 1] - first,
+                        )
+                        indices = torch.arange(col, col + F1.shape[1], device=F1.device)
+                        scores = torch.cat([best_scores, F1], dim=1)
+                        indices = torch.cat([best_indices, indices.expand_as(F1)], dim=1)
+
+                        best_scores, order = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+                        best_indices = indices.gather(1, order)
+
+                    yield start + row, best_indices.cpu().numpy(), best_scores.cpu().numpy()
+
+    @staticmethod
+    def _greedy_f1_pairs(
+        hyp: torch.Tensor, hyp_idf: torch.Tensor, refs: torch.Tensor, refs_idf: torch.Tensor
+    ) -> torch.Tensor:
+        """(n x K) F1 of BERTScore's greedy matching between each candidate and
+        its own K zero-padded references (n x K x L x D)."""
+
+        n_hyp, hyp_len, dim = hyp.shape
+        _, n_refs, ref_len, _ = refs.shape
+
+        # sim[n, i, c, j]: cosine between token i of candidate n and token j of its reference c
+        sim = torch.bmm(hyp, refs.view(n_hyp, -1, dim).transpose(1, 2))
+        sim = sim.view(n_hyp, hyp_len, n_refs, ref_len)
+
+        P = torch.einsum("nic,ni->nc", sim.amax(dim=3), hyp_idf)
+        R = torch.einsum("ncj,ncj->nc", sim.amax(dim=1), refs_idf)
+
+        return (2 * P * R / (P + R)).nan_to_num(0.0)
+
+    def rerank(
+        self,
+        questions: list[str],
+        faq: list[str],
+        candidates: np.ndarray,
+        k: int = 3,
+        memory_budget_mb: float = 512,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k of each question among its own shortlisted FAQ entries.
+
+        `candidates` is an (N x K) array of 0-based FAQ indices padded with -1,
+        as produced by `match_top_k` or `InvertedIndex.shortlist`. Only those
+        N x K pairs go through the greedy matching. Returns (N x k) indices,
+        padded with -1, and F1 scores, padded with NaN."""
+
+        self.encode(faq)
+        ref, ref_idf, offsets = self._flat(faq)
+        lengths = offsets.diff()
+        positions = torch.arange(int(lengths.max()), device=ref.device)
+
+        n_candidates = candidates.shape[1]
+        k = min(k, n_candidates)
+        indices = np.full((len(questions), k), -1, dtype=np.int64)
+        scores = np.full((len(questions), k), np.nan, dtype=np.float32)
+
+        # The gathered references and the similarity tensor of a block must fit the budget
+        budget = memory_budget_mb * 2**20 / ref.element_size()
+
+        with torch.no_grad():
+            for start in range(0, len(questions), self.batch_size):
+                batch = questions[start : start + self.batch_size]
+                hyp, hyp_idf = self._padded(batch, self._encode(list(dict.fromkeys(batch))))
+                row_size = n_candidates * len(positions) * (ref.shape[1] + hyp.shape[1])
+                rows = int(max(1, budget // row_size))
+
+                for row in range(0, len(batch), rows):
+                    block = slice(row, row + rows)
+                    shortlist = torch.as_tensor(candidates[start + row : start + row + len(hyp[block])])
+                    shortlist = shortlist.to(ref.device)
+                    valid = shortlist >= 0
+                    entries = shortlist.clamp(min=0)
+
+                    # Token positions of every shortlisted entry, zero-padded to the longest entry
+                    mask = (positions < lengths[entries].unsqueeze(-1)) & valid.unsqueeze(-1)
+                    tokens = torch.where(mask, offsets[entries].unsqueeze(-1) + positions, 0)
+                    refs = ref[tokens] * mask.unsqueeze(-1)
+                    refs_idf = ref_idf[tokens] * mask
+
+                    F1 = self._greedy_f1_pairs(hyp[block], hyp_idf[block], refs, refs_idf)
+                    F1 = F1.masked_fill(~valid, -torch.inf)
+
+                    top_scores, order = torch.topk(F1, k, dim=1)
+                    top_indices = shortlist.gather(1, order).masked_fill(top_scores == -torch.inf, -1)
+
+                    rows_out = slice(start + row, start + row + len(top_scores))
+                    indices[rows_out] = top_indices.cpu().numpy()
+                    top_scores = top_scores.masked_fill(top_scores == -torch.inf, torch.nan)
+                    scores[rows_out] = top_scores.cpu().numpy()
+
+        return indices, scores
+
+    def check_f1_matrix(self, questions: list[str], faq: list[str], atol: float = 1e-4) -> float:
+        """Compare `f1_matrix` with `BERTScorer.score` on the Cartesian product of
+        the inputs, which should be kept small. Returns the largest difference."""
+
+        _, _, F1 = self.score_pairs([question for question in questions for _ in faq], faq * len(questions))
+        reference = F1.view(len(questions), len(faq))
+        matrix = self.f1_matrix(questions, faq)
+        torch.testing.assert_close(matrix, reference, rtol=0, atol=atol)
+
+        return float((matrix - reference).abs().max())
+
+    def top_k(
+        self, questions: list[str], faq: list[str], k: int = 3, memory_budget_mb: float = 512
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """(N x k) 0-based indices and F1 scores of the best FAQ entries of each question."""
+
+        return concatenate_blocks(self.iter_top_k(questions, faq, k=k, memory_budget_mb=memory_budget_mb), k)
+
+    def best_match(self, questions: list[str], faq: list[str]) -> pd.DataFrame:
+        """Best FAQ entry of each question with the columns written by the
+        `bert_score` script: 1-based question and FAQ numbers and the F1 score."""
+
+        if not questions or not faq:
+            return pd.DataFrame()
+
+        indices, scores = self.top_k(questions, faq, k=1)
+
+        return pd.DataFrame(
+            {
+                "wpp_question": np.arange(1, len(questions) + 1),
+                "bert_match_faq_question": indices[:, 0] + 1,
+                "score": np.round(scores[:, 0].astype(np.float64), 4),
+            }
+        )
+
+
+def concatenate_blocks(
+    blocks: Iterable[tuple[int, np.ndarray, np.ndarray]], k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Stack the `(start, indices, scores)` blocks of `iter_top_k` or
+    `iter_sharded_top_k`, which come in question order."""
+
+    blocks = list(blocks)
+    if not blocks:
+        return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float32)
+
+    indices = np.concatenate([indices for _, indices, _ in blocks])
+    scores = np.concatenate([scores for _, _, scores in blocks])
+
+    return indices, scores
+
+
+# Matcher of a `BertScorePool` worker process, loaded once by `_init_worker`
+_worker_matcher: BertScoreMatcher | None = None
+_worker_barrier = None
+
+
+def _init_worker(matcher_kwargs: dict, threads: int, barrier) -> None:
+    global _worker_matcher, _worker_barrier
+
+    torch.set_num_threads(threads)
+    _worker_matcher = BertScoreMatcher(**matcher_kwargs)
+    _worker_barrier = barrier
+
+
+def _encode_in_worker(sentences: list[str]) -> None:
+    _worker_matcher.encode(sentences)
+
+
+def _wait_in_worker() -> None:
+    # Every worker holds one of these calls until all of them are running
+    _worker_barrier.wait()
+
+
+def _top_k_in_worker(
+    questions: list[str], faq: list[str], k: int, memory_budget_mb: float
+) -> tuple[np.ndarray, np.ndarray]:
+    return _worker_matcher.top_k(questions, faq, k=k, memory_budget_mb=memory_budget_mb)
+
+
+class BertScorePool:
+    """Pool of worker processes, each holding its own `BertScoreMatcher`
+    (`matcher_kwargs`), reused by every `iter_top_k` call until the pool is
+    closed. Use it as a context manager.
+
+    Each worker pins PyTorch to `threads_per_worker` intra-op threads, by
+    default the CPU count divided among the workers. The FAQ is encoded into
+    the `EmbeddingStore` at `store_dir` (a temporary one when None), so every
+    worker reads the same read-only memory map."""
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        threads_per_worker: int | None = None,
+        store_dir: str | None = None,
+        **matcher_kwargs,
+    ):
+        self.workers = workers or os.cpu_count()
+        self.threads_per_worker = threads_per_worker or max(1, os.cpu_count() // self.workers)
+        self.store_dir = store_dir
+        self.matcher_kwargs = matcher_kwargs
+        self._stack = contextlib.ExitStack()
+        self._executor: ProcessPoolExecutor | None = None
+
+    def __enter__(self) -> Self:
+        store_dir = self.store_dir
+        if store_dir is None:
+            store_dir = self._stack.enter_context(tempfile.TemporaryDirectory())
+
+        # Spawned, not forked: forking a process that already ran PyTorch's
+        # thread pools can deadlock the children
+        context = multiprocessing.get_context("spawn")
+        self._executor = self._stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(
+                    {**self.matcher_kwargs, "store_dir": store_dir},
+                    self.threads_per_worker,
+                    context.Barrier(self.workers),
+                ),
+            )
+        )
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._executor = None
+        self._stack.close()
+
+    def warm(self, faq: list[str]) -> None:
+        """Encode the FAQ into the store in one worker, then wait until every
+        worker has loaded its model, so later calls pay for neither."""
+
+        self._executor.submit(_encode_in_worker, faq).result()
+        for future in [self._executor.submit(_wait_in_worker) for _ in range(self.workers)]:
+            future.result()
+
+    def iter_top_k(
+        self,
+        questions: list[str],
+        faq: list[str],
+        k: int = 3,
+        shard_size: int = 256,
+        memory_budget_mb: float = 512,
+    ) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+        """`BertScoreMatcher.iter_top_k` with the questions dealt out to the
+        workers in shards of `shard_size`. Shards are yielded as `(start,
+        indices, scores)` in question order, whatever order they finish in.
+        `memory_budget_mb` applies per worker."""
+
+        starts = range(0, len(questions), shard_size)
+        shards = self._executor.map(
+            _top_k_in_worker,
+            [questions[start : start + shard_size] for start in starts],
+            itertools.repeat(faq),
+            itertools.repeat(k),
+            itertools.repeat(memory_budget_mb),
+        )
+        for start, (indices, scores) in zip(starts, shards, strict=True):
+            yield start, indices, scores
+
+
+def iter_sharded_top_k(
+    questions: list[str],
+    faq: list[str],
+    k: int = 3,
+    workers: int | None = None,
+    threads_per_worker: int | None = None,
+    shard_size: int = 256,
+    memory_budget_mb: float = 512,
+    store_dir: str | None = None,
+    **matcher_kwargs,
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """`BertScoreMatcher.iter_top_k` split across a one-off `BertScorePool`:
+    the FAQ is encoded once, then the questions are scored in shards of
+    `shard_size`, yielded in question order."""
+
+    with BertScorePool(workers, threads_per_worker, store_dir, **matcher_kwargs) as pool:
+        pool.warm(faq)
+        yield from pool.iter_top_k(
+            questions, faq, k=k, shard_size=shard_size, memory_budget_mb=memory_budget_mb
+        )
+
+
+def sharded_top_k(
+    questions: list[str], faq: list[str], k: int = 3, **kwargs
+) -> tuple[np.ndarray, np.ndarray]:
+    """(N x k) indices and F1 scores of `iter_sharded_top_k`, merged in question order."""
+
+    return concatenate_blocks(iter_sharded_top_k(questions, faq, k=k, **kwargs), k)
+
+
+def cascade_top_k(
+    questions: list[str],
+    faq_index: FaqIndex,
+    matcher: BertScoreMatcher,
+    shortlist_size: int = 20,
+    k: int = 3,
+    prefilter: Scorer = fuzz.token_set_ratio,
+) -> SimilarityResults:
+    """Retrieve-then-rerank: `prefilter` shortlists the `shortlist_size` best FAQ
+    entries of each question and BERTScore reranks only those.
+
+    The results hold both stages: the shortlist under the prefilter's name and
+    the reranked top-k under `bert_score`."""
+
+    shortlist = match_top_k(
+        faq_index.prepare_queries(questions), faq_index.processed, [prefilter], limit=shortlist_size
+    )
+    candidates = shortlist.indices[prefilter.__name__]
+    indices, scores = matcher.rerank(questions, faq_index.raw, candidates, k=k)
+
+    shortlist.indices["bert_score"] = indices
+    shortlist.scores["bert_score"] = scores.astype(np.float64)
+
+    return shortlist
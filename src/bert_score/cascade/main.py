@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from bert_matcher import BertScoreMatcher, cascade_top_k
+from faq_index import load_faq_index
+from matching import SimilarityResults
+from utils import evaluate_rankings, read_excel_cached
+
+SHORTLIST_SIZES = (5, 10, 20, 40)
+
+
+def make_output_csv(df_results: pd.DataFrame, df_annotations: pd.DataFrame) -> pd.DataFrame:
+    """Merges the similarity results with the original annotations and removes the merge key column"""
+
+    annotation_columns = ["n_wpp_questions", "wpp_question", "wpp_to_faq_annotation"]
+    df_annotations_unique = (
+        df_annotations[annotation_columns]
+        .dropna(subset=["wpp_question"])
+        .drop_duplicates(subset=["wpp_question"])
+    )
+    df_merged = pd.merge(df_annotations_unique, df_results, on="wpp_question", how="left")
+
+    return df_merged.drop("wpp_question", axis=1)
+
+
+def evaluate(
+    wpp_questions: list[str], results: SimilarityResults, df_faq_users: pd.DataFrame
+) -> pd.DataFrame:
+    """Hit rate anywhere in the list (recall@K for a shortlist), recall@1 and MRR
+    of each stage against the annotated sheet"""
+
+    methods_results = make_output_csv(results.to_wide_frame(wpp_questions), df_faq_users)
+    metrics, _ = evaluate_rankings(methods_results, k=1)
+
+    return metrics[["similarity_method", "accuracy", "recall@1", "mrr"]]
+
+
+def main():
+    df_faq_users = read_excel_cached(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+        fix_table=True,
+    )
+    faq_index = load_faq_index(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+    )
+    wpp_questions = df_faq_users["wpp_question"].dropna().tolist()
+    faq = faq_index.raw
+
+    matcher = BertScoreMatcher(lang="pt", model_type="bert-base-multilingual-cased")
+    # FAQ encoding is shared by every run below, keep it out of the timings
+    matcher.encode(faq)
+
+    start = time.perf_counter()
+    top_indices, top_scores = matcher.top_k(wpp_questions, faq, k=3)
+    full_seconds = time.perf_counter() - start
+
+    full = SimilarityResults(indices={"bert_score": top_indices}, scores={"bert_score": top_scores})
+    full_scores = evaluate(wpp_questions, full, df_faq_users)
+    full_scores.insert(0, "shortlist_size", len(faq))
+    full_scores["seconds"] = round(full_seconds, 4)
+    full_scores["bert_pairs"] = len(wpp_questions) * len(faq)
+
+    report = [full_scores]
+    for shortlist_size in SHORTLIST_SIZES:
+        start = time.perf_counter()
+        results = cascade_top_k(wpp_questions, faq_index, matcher, shortlist_size=shortlist_size, k=3)
+        seconds = time.perf_counter() - start
+
+        scores = evaluate(wpp_questions, results, df_faq_users)
+        scores.insert(0, "shortlist_size", shortlist_size)
+        scores["seconds"] = round(seconds, 4)
+        scores["bert_pairs"] = int((results.indices["token_set_ratio"] >= 0).sum())
+        report.append(scores)
+
+    report = pd.concat(report, ignore_index=True)
+    report["speedup"] = round(full_seconds / report["seconds"], 2)
+    # End-to-end accuracy lost by reranking a shortlist instead of the whole FAQ
+    report["accuracy_delta"] = (report["accuracy"] - full_scores["accuracy"].iloc[0]).where(
+        report["similarity_method"] == "bert_score"
+    )
+    report.to_csv("cascade_report.csv", index=False)
+
+
+main()
@@ -4,8 +4,13 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import pandas as pd
 
-from bert_score import score
-from utils import calculate_scores, fix_excel_table, remove_stopwords
+from bert_matcher import BertScoreMatcher
+from utils import calculate_scores, read_excel_cached, remove_stopwords
+
+# Opt-in int8 dynamic quantization of the scoring model (CPU only)
+QUANTIZE = os.getenv("BERT_QUANTIZE", "0") == "1"
+# FAQ token embeddings persisted across runs, see `EmbeddingStore`
+EMBEDDING_STORE_DIR = "../../data/.cache/embeddings"
 
 
 def calculate_bert_score(
@@ -13,54 +18,31 @@ def calculate_bert_score(
     faq_questions: list,
     lang: str = "pt",
     model_type: str = "bert-base-multilingual-cased",
+    quantize: bool = False,
+    store_dir: str | None = None,
 ) -> pd.DataFrame:
     "Calculate bert score between elements of two lists"
 
-    if not whatsapp_questions or not faq_questions:
-        return pd.DataFrame()
-
-    results = []
-
-    for i, wq in enumerate(whatsapp_questions):
-        _, _, F1 = score(
-            [wq] * len(faq_questions),
-            faq_questions,
-            lang=lang,
-            model_type=model_type,
-        )
-
-        best_score = F1.max().item()
-        best_match_idx = F1.argmax().item()
+    matcher = BertScoreMatcher(lang=lang, model_type=model_type, quantize=quantize, store_dir=store_dir)
 
-        results.append(
-            {
-                "wpp_question": int(i + 1),
-                "bert_match_faq_question": int(best_match_idx + 1),
-                "score": round(best_score, 4),
-            }
-        )
-
-    return pd.DataFrame(results)
+    return matcher.best_match(whatsapp_questions, faq_questions)
 
 
 def main():
-    df_faq_users = pd.read_excel(
+    df_faq_users = read_excel_cached(
         io="../../data/Perguntas_chatbot - 09.10_relacao FAQ perguntas users.xlsx",
         sheet_name="relacao",
+        fix_table=True,
     )
-
-    df_faq_users = fix_excel_table(df_faq_users)
     wpp_questions = remove_stopwords(df_faq_users["wpp_question"].dropna().tolist())
     faq = remove_stopwords(df_faq_users["pergunta_faq"].dropna().tolist())
 
-    bert_scores = calculate_bert_score(wpp_questions, faq)
+    bert_scores = calculate_bert_score(wpp_questions, faq, quantize=QUANTIZE, store_dir=EMBEDDING_STORE_DIR)
 
-    df_final = pd.concat(
-        [bert_scores, df_faq_users["wpp_to_faq_annotation"].dropna(how="all")], axis=1
+    annotations = df_faq_users[["n_wpp_questions", "wpp_to_faq_annotation"]].dropna(
+        subset=["wpp_to_faq_annotation"]
     )
-
-    last_col = df_final.pop("wpp_to_faq_annotation")
-    df_final.insert(1, "wpp_to_faq_annotation", last_col)
+    df_final = pd.concat([annotations, bert_scores], axis=1)
 
     df_final.to_csv("bert_scores.csv", index=False)
 
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+if os.name != "nt":
+    import resource
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from bert_matcher import BertScoreMatcher
+from utils import (
+    calculate_list_scores,
+    read_excel_cached,
+)
+
+MODES = {"fp32": False, "int8": True}
+
+
+def make_output_csv(df_results: pd.DataFrame, df_annotations: pd.DataFrame) -> pd.DataFrame:
+    """Merges the similarity results with the original annotations and removes the merge key column"""
+
+    annotation_columns = ["n_wpp_questions", "wpp_question", "wpp_to_faq_annotation"]
+    df_annotations_unique = (
+        df_annotations[annotation_columns]
+        .dropna(subset=["wpp_question"])
+        .drop_duplicates(subset=["wpp_question"])
+    )
+    df_merged = pd.merge(df_annotations_unique, df_results, on="wpp_question", how="left")
+
+    return df_merged.drop("wpp_question", axis=1)
+
+
+def load_relacao_clean() -> pd.DataFrame:
+    return read_excel_cached(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+        fix_table=True,
+    )
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process, or None on Windows, which has
+    no `resource` module."""
+
+    if os.name == "nt":
+        return None
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def run_mode(quantize: bool) -> dict:
+    """Score the annotated sheet in a fresh process, so the peak RSS of each
+    mode is measured on its own (where it can be, see `peak_rss_mb`)."""
+
+    df_faq_users = load_relacao_clean()
+    wpp_questions = df_faq_users["wpp_question"].dropna().tolist()
+    faq = df_faq_users["pergunta_faq"].dropna().tolist()
+
+    start = time.perf_counter()
+    matcher = BertScoreMatcher(lang="pt", model_type="bert-base-multilingual-cased", quantize=quantize)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    top_indices, top_scores = matcher.top_k(wpp_questions, faq, k=3)
+    seconds = time.perf_counter() - start
+
+    methods_results = pd.DataFrame(
+        {
+            "wpp_question": wpp_questions,
+            "bert_score_question": (top_indices + 1).tolist(),
+            "bert_score_value": np.round(top_scores.astype(np.float64), 4).tolist(),
+        }
+    )
+    methods_scores = calculate_list_scores(make_output_csv(methods_results, df_faq_users))
+
+    return {
+        "questions": len(wpp_questions),
+        "faq_questions": len(faq),
+        "load_seconds": round(load_seconds, 4),
+        "seconds": round(seconds, 4),
+        "questions_per_second": round(len(wpp_questions) / seconds, 2),
+        "sentences_per_second": round((len(wpp_questions) + len(faq)) / seconds, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "accuracy": methods_scores["accuracy"].iloc[0],
+    }
+
+
+def main():
+    report = []
+    for mode, quantize in MODES.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            report.append({"mode": mode, **executor.submit(run_mode, quantize).result()})
+
+    report = pd.DataFrame(report)
+    baseline = report[report["mode"] == "fp32"].iloc[0]
+    report["speedup"] = round(baseline["seconds"] / report["seconds"], 2)
+    report["accuracy_delta"] = report["accuracy"] - baseline["accuracy"]
+    report.to_csv("quantization_report.csv", index=False)
+    print(report.to_string(index=False))
+
+
+# Each mode runs in a spawned process that re-imports this module
+if __name__ == "__main__":
+    main()
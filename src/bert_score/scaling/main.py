@@ -0,0 +1,86 @@
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from bert_matcher import BertScorePool, concatenate_blocks
+from utils import read_excel_cached
+
+# FAQ token embeddings persisted across runs, see `EmbeddingStore`
+EMBEDDING_STORE_DIR = "../../../data/.cache/embeddings"
+
+# Shards of questions each worker scores at the largest worker count, and
+# questions per shard (one encoding batch)
+SHARDS_PER_WORKER = 4
+SHARD_SIZE = 64
+
+
+def worker_counts() -> list[int]:
+    """Powers of two up to the number of CPUs, plus the CPU count itself."""
+
+    cpus = os.cpu_count()
+    return sorted({2**exponent for exponent in range(cpus.bit_length()) if 2**exponent <= cpus} | {cpus})
+
+
+def benchmark_questions(questions: list[str], n: int) -> list[str]:
+    """`n` distinct questions cycled from `questions`, numbered from the second
+    round on so that no copy is deduplicated away when it is encoded."""
+
+    return [
+        question if i < len(questions) else f"{question} ({i // len(questions)})"
+        for i, question in zip(range(n), itertools.cycle(questions), strict=False)
+    ]
+
+
+def main():
+    df_faq_users = read_excel_cached(
+        io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
+        sheet_name="relacao_clean",
+        fix_table=True,
+    )
+    wpp_questions = df_faq_users["wpp_question"].dropna().tolist()
+    faq = df_faq_users["pergunta_faq"].dropna().tolist()
+
+    # Enough questions to give every worker of the largest pool several shards
+    counts = worker_counts()
+    questions = benchmark_questions(
+        wpp_questions, max(len(wpp_questions), SHARDS_PER_WORKER * SHARD_SIZE * counts[-1])
+    )
+
+    report = []
+    reference = None
+    for workers in counts:
+        with BertScorePool(workers, store_dir=EMBEDDING_STORE_DIR) as pool:
+            # Process start-up, model loading and FAQ encoding stay out of the timing
+            pool.warm(faq)
+
+            start = time.perf_counter()
+            indices, _ = concatenate_blocks(pool.iter_top_k(questions, faq, k=3, shard_size=SHARD_SIZE), k=3)
+            seconds = time.perf_counter() - start
+
+        reference = indices if reference is None else reference
+        report.append(
+            {
+                "workers": workers,
+                "threads_per_worker": pool.threads_per_worker,
+                "questions": len(questions),
+                "seconds": round(seconds, 4),
+                "questions_per_second": round(len(questions) / seconds, 2),
+                # Share of questions whose top-1 matches the single-worker run
+                "top1_agreement": float(np.mean(indices[:, 0] == reference[:, 0])),
+            }
+        )
+        print(report[-1])
+
+    report = pd.DataFrame(report)
+    report["speedup"] = round(report["seconds"].iloc[0] / report["seconds"], 2)
+    report.to_csv("scaling_report.csv", index=False)
+
+
+# Workers are spawned processes that re-import this module
+if __name__ == "__main__":
+    main()
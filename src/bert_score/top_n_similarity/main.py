@@ -1,17 +1,28 @@
+import json
 import os
 import sys
 
+import numpy as np
 import pandas as pd
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
-import torch
-
-from bert_score import score as bert_scorer
+from bert_matcher import BertScoreMatcher, iter_sharded_top_k
 from utils import (
     calculate_list_scores,
-    fix_excel_table,
+    read_excel_cached,
 )
 
+MEMORY_BUDGET_MB = 512
+# FAQ token embeddings persisted across runs, see `EmbeddingStore`
+EMBEDDING_STORE_DIR = "../../../data/.cache/embeddings"
+# Opt-in int8 dynamic quantization of the scoring model (CPU only)
+QUANTIZE = os.getenv("BERT_QUANTIZE", "0") == "1"
+# Opt-in sharding of the questions across worker processes, see `iter_sharded_top_k`
+WORKERS = int(os.getenv("BERT_WORKERS", "1"))
+# Opt-in check of a couple of rows against the pairwise bert_score, see `check_f1_matrix`
+CHECK_F1 = os.getenv("BERT_CHECK_F1", "0") == "1"
+TOP_K_CSV = "bert_top_k.csv"
+
 
 def make_output_csv(df_results: pd.DataFrame, df_annotations: pd.DataFrame) -> pd.DataFrame:
     """Merges the similarity results with the original annotations and removes the merge key column"""
@@ -35,44 +46,61 @@ def make_output_csv(df_results: pd.DataFrame, df_annotations: pd.DataFrame) -> p
 
 def process_bert_score_results(
     original_questions: list[str],
-    f1_scores_matrix: torch.Tensor,
-    limit: int = 3,
+    top_indices: np.ndarray,
+    top_scores: np.ndarray,
 ) -> pd.DataFrame:
-    """Processes the reshaped (N x M) F1 score matrix from BERT Score"""
-
-    processed_data = []
-    for i, question in enumerate(original_questions):
-        top_scores, top_indices = torch.topk(f1_scores_matrix[i], limit)
+    """Processes the (N x k) top FAQ indices and F1 scores from BERT Score"""
 
-        row_data = {
-            "wpp_question": question,  # Use the original question as the key for merging
-            "bert_score_question": [idx.item() + 1 for idx in top_indices],
-            "bert_score_value": [round(score.item(), 4) for score in top_scores],
+    return pd.DataFrame(
+        {
+            "wpp_question": original_questions,  # Use the original question as the key for merging
+            "bert_score_question": (top_indices + 1).tolist(),
+            "bert_score_value": np.round(top_scores.astype(np.float64), 4).tolist(),
         }
-        processed_data.append(row_data)
-
-    return pd.DataFrame(processed_data)
+    )
 
 
 def main():
-    df_faq_users = pd.read_excel(
+    df_faq_users = read_excel_cached(
         io="../../../data/Perguntas_chatbot_clean - 09.10_relacao FAQ perguntas users.xlsx",
         sheet_name="relacao_clean",
+        fix_table=True,
     )
-
-    df_faq_users = fix_excel_table(df_faq_users)
     wpp_questions = df_faq_users["wpp_question"].dropna().tolist()
     faq = df_faq_users["pergunta_faq"].dropna().tolist()
 
-    num_wpp = len(wpp_questions)
-    num_faq = len(faq)
-    cands_batch = [q for q in wpp_questions for _ in range(num_faq)]
-    refs_batch = faq * num_wpp
-
-    P, R, F1 = bert_scorer(cands_batch, refs_batch, lang="pt", model_type="bert-base-multilingual-cased")
-    f1_matrix = F1.view(num_wpp, num_faq)
-
-    methods_results = process_bert_score_results(wpp_questions, f1_matrix, limit=3)
+    matcher_kwargs = {
+        "lang": "pt",
+        "model_type": "bert-base-multilingual-cased",
+        "quantize": QUANTIZE,
+        "store_dir": EMBEDDING_STORE_DIR,
+    }
+
+    if WORKERS > 1:
+        top_k_blocks = iter_sharded_top_k(
+            wpp_questions, faq, k=3, workers=WORKERS, memory_budget_mb=MEMORY_BUDGET_MB, **matcher_kwargs
+        )
+    else:
+        # Each sentence is encoded once and all N x M pairs are scored from the cached
+        # embeddings
+        matcher = BertScoreMatcher(**matcher_kwargs)
+        if CHECK_F1:
+            matcher.check_f1_matrix(wpp_questions[:2], faq)
+        top_k_blocks = matcher.iter_top_k(wpp_questions, faq, k=3, memory_budget_mb=MEMORY_BUDGET_MB)
+
+    # Question blocks are scored within the memory budget and appended to the
+    # top-k file as soon as they are ready, so none is kept in memory
+    with open(TOP_K_CSV, "w", encoding="utf-8", newline="") as sink:
+        for start, top_indices, top_scores in top_k_blocks:
+            block = process_bert_score_results(
+                wpp_questions[start : start + len(top_indices)], top_indices, top_scores
+            )
+            block.to_csv(sink, header=start == 0, index=False)
+
+    # The evaluation reads the top-k file back; its lists are written as JSON arrays
+    methods_results = pd.read_csv(
+        TOP_K_CSV, converters={"bert_score_question": json.loads, "bert_score_value": json.loads}
+    )
     methods_results_final = make_output_csv(methods_results, df_faq_users)
     methods_results_final.to_csv("methods_results_bert.csv", index=False)
 
@@ -80,4 +108,6 @@ def main():
     methods_scores.to_csv("methods_scores_bert.csv", index=False)
 
 
-main()
+# With BERT_WORKERS > 1 the workers are spawned processes that re-import this module
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import hashlib
+import os
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from matching import SimilarityResults
+
+DENSE_INDEX_VERSION = 1
+DEFAULT_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+class DenseMatcher:
+    """Bi-encoder FAQ matcher: questions and FAQ entries are embedded
+    independently and matched by cosine similarity in a FAISS index.
+
+    Embeddings are L2-normalized, so the inner product of the index is the
+    cosine. `hnsw=True` builds an approximate HNSW graph instead of the exact
+    flat index, for FAQs too large for a brute-force scan."""
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL_NAME,
+        batch_size: int = 64,
+        hnsw: bool = False,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        device: str | None = None,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.hnsw = hnsw
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.model = SentenceTransformer(model_name, device=device)
+        self.index: faiss.Index | None = None
+        self.faq_key: str | None = None
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """(len x D) float32 L2-normalized embeddings, encoded in batches."""
+
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32)
+
+    def index_key(self, faq: list[str]) -> str:
+        """Hash of everything the index depends on: model, index type and FAQ texts."""
+
+        digest = hashlib.sha256()
+        index_type = f"hnsw{self.hnsw_m}" if self.hnsw else "flat"
+        digest.update(f"{DENSE_INDEX_VERSION}|{self.model_name}|{index_type}".encode())
+        for text in faq:
+            digest.update(b"\0" + text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def build_index(self, faq: list[str]) -> faiss.Index:
+        embeddings = self.embed(faq)
+        dim = embeddings.shape[1]
+
+        if self.hnsw:
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+        else:
+            index = faiss.IndexFlatIP(dim)
+
+        index.add(embeddings)
+        return index
+
+    def load_index(self, faq: list[str], cache_dir: str | None = None) -> faiss.Index:
+        """Index of the FAQ, read from `cache_dir` when this exact FAQ was
+        embedded before, and built then saved there otherwise."""
+
+        key = self.index_key(faq)
+        path = None if cache_dir is None else os.path.join(cache_dir, f"dense_{key[:16]}.faiss")
+
+        if path is not None and os.path.exists(path):
+            self.index = faiss.read_index(path)
+        else:
+            self.index = self.build_index(faq)
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                faiss.write_index(self.index, tmp_path)
+                os.replace(tmp_path, path)
+
+        if self.hnsw:
+            self.index.hnsw.efSearch = self.ef_search
+
+        self.faq_key = key
+        return self.index
+
+    def search(self, questions: list[str], k: int = 3) -> tuple[np.ndarray, np.ndarray]:
+        """(N x k) 0-based FAQ indices, padded with -1, and cosine scores, padded
+        with NaN, of the best entries of each question."""
+
+        if self.index is None:
+            raise ValueError("No FAQ index loaded, call load_index first.")
+
+        scores, indices = self.index.search(self.embed(questions), min(k, self.index.ntotal))
+        scores = np.where(indices >= 0, scores, np.nan).astype(np.float64)
+
+        return indices.astype(np.int64), scores
+
+    def match(
+        self,
+        questions: list[str],
+        faq: list[str],
+        k: int = 3,
+        cache_dir: str | None = None,
+        name: str = "dense",
+    ) -> SimilarityResults:
+        """Top-k FAQ entries of every question under the method `name`, ready
+        for `to_wide_frame` and `calculate_list_scores`."""
+
+        if self.faq_key != self.index_key(faq):
+            self.load_index(faq, cache_dir)
+        indices, scores = self.search(questions, k)
+
+        return SimilarityResults(indices={name: indices}, scores={name: scores})
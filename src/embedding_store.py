@@ -0,0 +1,298 @@
+import contextlib
+import hashlib
+import json
+import os
+
+import numpy as np
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+EMBEDDING_STORE_VERSION = 2
+# Texts are compacted once more than this fraction of the tokens they span
+# in the store belongs to other texts, see `EmbeddingStore.needs_compaction`
+COMPACT_STALE_FRACTION = 0.5
+
+
+def text_hash(text: str) -> str:
+    """SHA-256 of the text."""
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """Exclusive lock on the file at `path` across processes: `fcntl.flock` on
+    POSIX, `msvcrt.locking` on Windows."""
+
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            while True:
+                f.seek(0)
+                try:
+                    # LK_LOCK itself gives up after 10 attempts
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class EmbeddingStore:
+    """Append-only on-disk store of per-sentence token embeddings and weights.
+
+    The tokens of every sentence are laid end to end in the raw float32 files
+    `embeddings.<n>.f32` (T x D) and `weights.<n>.f32` (T,), and `index.json`
+    holds T, D and the `[offset, length]` of each text hash in generation `n`
+    of the files. New sentences are appended to the files in place and only
+    become visible once the index counts them; `compact` is the only
+    operation that writes a new generation. The files are opened as read-only
+    memory maps, so every process scoring against the same store shares its
+    pages instead of holding a copy. One store directory holds one model."""
+
+    def __init__(self, path: str, model: str):
+        self.path = path
+        self.model = model
+        self.reload()
+
+    @classmethod
+    def open(cls, cache_dir: str, model: str) -> "EmbeddingStore":
+        """Store of `model` under `cache_dir`, one subdirectory per model."""
+
+        return cls(os.path.join(cache_dir, model.replace("/", "--")), model)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _map(self, name: str, generation: int, shape: tuple[int, ...]) -> np.ndarray:
+        if not shape[0]:
+            return np.empty(shape, dtype=np.float32)
+        return np.memmap(self._file(f"{name}.{generation}.f32"), dtype=np.float32, mode="r", shape=shape)
+
+    def reload(self, attempts: int = 3) -> None:
+        """Pick up the latest state written by any process.
+
+        A compaction removes the previous generation once the new index is in
+        place, so a reader that loses that race reads the index again. A store
+        written by another version of this class is treated as empty."""
+
+        self.generation = self.tokens = self.dim = 0
+        self.entries: dict[str, tuple[int, int]] = {}
+        self.embeddings = self.weights = None
+
+        if not os.path.exists(self._file("index.json")):
+            return
+
+        for attempt in range(attempts):
+            with open(self._file("index.json"), encoding="utf-8") as f:
+                index = json.load(f)
+
+            if index["version"] != EMBEDDING_STORE_VERSION:
+                return
+            if index["model"] != self.model:
+                raise ValueError(f"{self.path} holds a store of {index['model']}, not {self.model}")
+
+            try:
+                self.embeddings = self._map(
+                    "embeddings", index["generation"], (index["tokens"], index["dim"])
+                )
+                self.weights = self._map("weights", index["generation"], (index["tokens"],))
+                break
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+
+        self.generation = index["generation"]
+        self.tokens = index["tokens"]
+        self.dim = index["dim"]
+        self.entries = {key: tuple(entry) for key, entry in index["entries"].items()}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, text: str) -> bool:
+        return text_hash(text) in self.entries
+
+    def missing(self, texts: list[str]) -> list[str]:
+        """Texts without stored embeddings, without duplicates, in input order."""
+
+        return [text for text in dict.fromkeys(texts) if text not in self]
+
+    def get(self, text: str) -> tuple[np.ndarray, np.ndarray]:
+        """Read-only (L x D) embeddings and (L,) weights of a stored text."""
+
+        offset, length = self.entries[text_hash(text)]
+        return self.embeddings[offset : offset + length], self.weights[offset : offset + length]
+
+    def _spans(self, texts: list[str]) -> np.ndarray:
+        return np.array([self.entries[text_hash(text)] for text in texts], dtype=np.int64).reshape(-1, 2)
+
+    def is_contiguous(self, texts: list[str]) -> bool:
+        """Whether the texts are stored end to end in order, so `flat` can serve
+        them without copying."""
+
+        spans = self._spans(texts)
+        return bool(np.array_equal(spans[1:, 0], spans[:-1].sum(axis=1)))
+
+    def stale_fraction(self, texts: list[str]) -> float:
+        """Fraction of the tokens between the first and the last of `texts` in
+        the files that belong to other texts."""
+
+        spans = self._spans(texts)
+        if not len(spans):
+            return 0.0
+        extent = spans.sum(axis=1).max() - spans[:, 0].min()
+        return 1.0 - spans[:, 1].sum() / max(extent, 1)
+
+    def needs_compaction(self, texts: list[str], stale_fraction: float = COMPACT_STALE_FRACTION) -> bool:
+        """Whether `texts` are worth a `compact`: they are not contiguous and
+        more than `stale_fraction` of the tokens they span belongs to other
+        texts. Below that, `flat` gathers them instead.
+
+        Two callers (FAQs) sharing texts cannot both be contiguous, and
+        compacting for one scatters the other; with the threshold, the other
+        is only compacted in turn when it is much smaller, so they never keep
+        rewriting the store one after the other."""
+
+        return not self.is_contiguous(texts) and self.stale_fraction(texts) > stale_fraction
+
+    def flat(self, texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Embeddings and weights of `texts` laid end to end, with the (len + 1)
+        offsets of each text in them.
+
+        When the texts are contiguous (the layout `add` and `compact` produce)
+        the arrays are zero-copy views of the memory map; otherwise they are
+        gathered into new arrays."""
+
+        spans = self._spans(texts)
+        offsets = np.concatenate([[0], np.cumsum(spans[:, 1])])
+
+        if self.is_contiguous(texts):
+            tokens = slice(spans[0, 0], spans[0, 0] + offsets[-1]) if len(spans) else slice(0, 0)
+        else:
+            tokens = np.concatenate([np.arange(offset, offset + length) for offset, length in spans])
+
+        return self.embeddings[tokens], self.weights[tokens], offsets
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """Exclusive lock held while the store is written, so concurrent
+        writers append or compact one after the other."""
+
+        os.makedirs(self.path, exist_ok=True)
+        with file_lock(self._file(".lock")):
+            yield
+
+    def _write_index(
+        self, generation: int, tokens: int, dim: int, entries: dict[str, tuple[int, int]]
+    ) -> None:
+        index = {
+            "version": EMBEDDING_STORE_VERSION,
+            "model": self.model,
+            "generation": generation,
+            "tokens": tokens,
+            "dim": dim,
+            "entries": entries,
+        }
+        tmp_path = self._file("index.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._file("index.json"))
+
+    def _append(self, name: str, rows: np.ndarray, offset: int) -> None:
+        """Write `rows` at token `offset` of the current generation's file.
+        Bytes past the indexed tokens (left by an interrupted append) are
+        overwritten; readers never look past the tokens their index counts."""
+
+        rows = np.ascontiguousarray(rows, dtype=np.float32)
+        row_bytes = rows.itemsize * int(np.prod(rows.shape[1:]))
+
+        path = self._file(f"{name}.{self.generation}.f32")
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(offset * row_bytes)
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, encoded: dict[str, tuple[np.ndarray, np.ndarray]]) -> None:
+        """Append the `{text: (embeddings, weights)}` not stored yet, in the
+        order given. Only the new rows are written."""
+
+        with self._lock():
+            self.reload()
+            new = {text: value for text, value in encoded.items() if text not in self}
+            if not new:
+                return
+
+            dim = self.dim or next(embeddings.shape[1] for embeddings, _ in new.values())
+            entries = dict(self.entries)
+            position = self.tokens
+            for text, (_, weights) in new.items():
+                entries[text_hash(text)] = (position, len(weights))
+                position += len(weights)
+
+            embeddings = np.concatenate([embeddings.reshape(-1, dim) for embeddings, _ in new.values()])
+            weights = np.concatenate([weights for _, weights in new.values()])
+            self._append("embeddings", embeddings, self.tokens)
+            self._append("weights", weights, self.tokens)
+
+            self._write_index(self.generation, position, dim, entries)
+            self.reload()
+
+    def compact(self, texts: list[str]) -> None:
+        """Rewrite the store as a new generation in which `texts` are
+        contiguous and in order, so `flat` serves them without a copy. Nothing
+        is re-encoded, and the entries of other texts are kept: several
+        callers (FAQs) may share the store."""
+
+        with self._lock():
+            self.reload()
+            texts = list(dict.fromkeys(texts))
+            keys = [text_hash(text) for text in texts]
+            others = sorted(self.entries.keys() - set(keys), key=lambda key: self.entries[key][0])
+
+            generation = self.generation + 1
+            entries, spans, position = {}, [], 0
+            for key in others + keys:
+                offset, length = self.entries[key]
+                entries[key] = (position, length)
+                spans.append((offset, length))
+                position += length
+
+            for name, source, shape in (
+                ("embeddings", self.embeddings, (position, self.dim)),
+                ("weights", self.weights, (position,)),
+            ):
+                tmp_path = self._file(f"{name}.{generation}.f32.tmp")
+                array = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=shape) if position else None
+                written = 0
+                for offset, length in spans:
+                    array[written : written + length] = source[offset : offset + length]
+                    written += length
+                if array is not None:
+                    array.flush()
+                    del array
+                else:
+                    open(tmp_path, "wb").close()
+                os.replace(tmp_path, self._file(f"{name}.{generation}.f32"))
+
+            self._write_index(generation, position, self.dim, entries)
+
+            previous = self.generation
+            self.reload()
+            for name in ("embeddings", "weights"):
+                # Still mapped by a reader on Windows: left for a later compaction
+                with contextlib.suppress(OSError):
+                    os.remove(self._file(f"{name}.{previous}.f32"))
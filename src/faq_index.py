@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+
+from rapidfuzz.utils import default_process
+
+from utils import file_hash, read_excel_cached, remove_stopwords
+
+FAQ_INDEX_VERSION = 1
+
+
+@dataclass
+class FaqIndex:
+    """Preprocessed FAQ texts, built once per version of the source sheet.
+
+    `processed` is what the rapidfuzz matchers should score against, always with
+    `processor=None`, since `default_process` has already been applied."""
+
+    key: str
+    raw: list[str]
+    clean: list[str]
+    processed: list[str]
+    tokens: list[list[str]]
+    strip_stopwords: bool = True
+
+    @classmethod
+    def build(cls, key: str, faq: list[str], strip_stopwords: bool = True) -> "FaqIndex":
+        """Run the normalization pipeline over the FAQ texts."""
+
+        clean = remove_stopwords(faq) if strip_stopwords else list(faq)
+        processed = [default_process(text) for text in clean]
+
+        return cls(
+            key=key,
+            raw=list(faq),
+            clean=clean,
+            processed=processed,
+            tokens=[text.split() for text in processed],
+            strip_stopwords=strip_stopwords,
+        )
+
+    def prepare_queries(self, queries: list[str]) -> list[str]:
+        """Apply to the queries the same normalization used for the FAQ."""
+
+        if self.strip_stopwords:
+            queries = remove_stopwords(queries)
+        return [default_process(query) for query in queries]
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FaqIndex":
+        with open(path, encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+
+def load_faq_index(
+    io: str,
+    sheet_name: str | int = 0,
+    column: str = "pergunta_faq",
+    fix_table: bool = True,
+    strip_stopwords: bool = True,
+    cache_dir: str | None = None,
+) -> FaqIndex:
+    """Load the FAQ index of a sheet from disk, rebuilding it when the sheet
+    content or the preprocessing options change."""
+
+    key_parts = [FAQ_INDEX_VERSION, file_hash(io), sheet_name, column, fix_table, strip_stopwords]
+    key = hashlib.sha256(json.dumps(key_parts).encode()).hexdigest()
+
+    cache_dir = cache_dir or os.path.join(os.path.dirname(io), ".cache")
+    source_name = os.path.splitext(os.path.basename(io))[0]
+    index_path = os.path.join(cache_dir, f"{source_name}_{sheet_name}_{column}.faq_index.json")
+
+    if os.path.exists(index_path):
+        index = FaqIndex.load(index_path)
+        if index.key == key:
+            return index
+
+    df = read_excel_cached(io=io, sheet_name=sheet_name, fix_table=fix_table)
+    index = FaqIndex.build(key, df[column].dropna().tolist(), strip_stopwords=strip_stopwords)
+    index.save(index_path)
+
+    return index
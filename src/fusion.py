@@ -0,0 +1,150 @@
+import itertools
+from collections.abc import Sequence
+
+import numpy as np
+import pandas as pd
+
+from matching import SimilarityResults, top_k
+from utils import evaluate_rankings, ground_truth
+
+
+def rank_matrix(matrix: np.ndarray) -> np.ndarray:
+    """1-based rank of every choice in each row, ties broken by choice position."""
+
+    order = np.argsort(-matrix, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, matrix.shape[1] + 1), axis=1)
+
+    return ranks
+
+
+def weighted_sum(
+    matrices: dict[str, np.ndarray], weights: dict[str, float] | None = None
+) -> np.ndarray:
+    """Weighted sum of the score matrices, each rescaled to [0, 1] by its maximum."""
+
+    weights = weights or dict.fromkeys(matrices, 1.0)
+    fused = np.zeros(next(iter(matrices.values())).shape, dtype=np.float64)
+
+    for name, matrix in matrices.items():
+        fused += weights.get(name, 0.0) * matrix / max(matrix.max(), 1e-12)
+
+    return fused
+
+
+def reciprocal_rank_fusion(
+    matrices: dict[str, np.ndarray],
+    weights: dict[str, float] | None = None,
+    depth: int | None = None,
+    k: int = 60,
+) -> np.ndarray:
+    """Reciprocal-rank fusion: sum of weight / (k + rank) over the top-`depth`
+    choices of each scorer (all choices when `depth` is None)."""
+
+    weights = weights or dict.fromkeys(matrices, 1.0)
+    fused = np.zeros(next(iter(matrices.values())).shape, dtype=np.float64)
+
+    for name, matrix in matrices.items():
+        ranks = rank_matrix(matrix)
+        contribution = weights.get(name, 0.0) / (k + ranks)
+        if depth is not None:
+            contribution[ranks > depth] = 0.0
+        fused += contribution
+
+    return fused
+
+
+def borda_count(
+    matrices: dict[str, np.ndarray],
+    weights: dict[str, float] | None = None,
+    depth: int = 10,
+) -> np.ndarray:
+    """Borda count over the top-`depth` lists: a choice ranked r earns depth - r + 1 points."""
+
+    weights = weights or dict.fromkeys(matrices, 1.0)
+    fused = np.zeros(next(iter(matrices.values())).shape, dtype=np.float64)
+
+    for name, matrix in matrices.items():
+        points = np.clip(depth + 1 - rank_matrix(matrix), 0, None)
+        fused += weights.get(name, 0.0) * points
+
+    return fused
+
+
+FUSION_METHODS = {
+    "weighted_sum": weighted_sum,
+    "rrf": reciprocal_rank_fusion,
+    "borda": borda_count,
+}
+
+
+def fused_results(fused: np.ndarray, name: str, limit: int = 1) -> SimilarityResults:
+    """Top-`limit` choices of a fused score matrix."""
+
+    indices, scores = top_k(fused, limit)
+    return SimilarityResults(indices={name: indices}, scores={name: scores})
+
+
+def grid_search(
+    matrices: dict[str, np.ndarray],
+    df_annotations: pd.DataFrame,
+    grid: Sequence[float] = (0.0, 0.5, 1.0),
+    method: str = "weighted_sum",
+    limit: int = 1,
+    memory_budget_mb: float = 512,
+) -> pd.DataFrame:
+    """Score every weight combination of `grid` over the scorers.
+
+    Each chunk of combinations is fused with a single tensor contraction and
+    evaluated in one `evaluate_rankings` pass. Chunks, and blocks of question
+    rows when a single combination does not fit, are sized so that the fused
+    scores fit `memory_budget_mb`; only their top-`limit` choices are kept. `df_annotations` must be aligned
+    row by row with the matrices and hold `n_wpp_questions` and
+    `wpp_to_faq_annotation`.
+
+    Returns one row per combination with its weights, accuracy (the
+    `calculate_list_scores` metric), recall@k and MRR, best first."""
+
+    # Every fusion is linear in the weights: fusing each scorer alone once is
+    # enough to rebuild any weighted combination with a tensor contraction.
+    names = list(matrices)
+    fusion = FUSION_METHODS[method]
+    stacked = np.stack([fusion({name: matrices[name]}) for name in names])
+
+    combinations = np.array(
+        [weights for weights in itertools.product(grid, repeat=len(names)) if any(weights)]
+    )
+    truth = ground_truth(df_annotations)
+    annotations = df_annotations[["n_wpp_questions", "wpp_to_faq_annotation"]]
+
+    _, n_questions, n_choices = stacked.shape
+    budget = memory_budget_mb * 2**20 / stacked.itemsize
+    chunk_size = int(min(len(combinations), max(1, budget // (n_questions * n_choices))))
+    rows = int(max(1, budget // (chunk_size * n_choices)))
+
+    reports = []
+    for start in range(0, len(combinations), chunk_size):
+        chunk = combinations[start : start + chunk_size]
+        n_combinations = len(chunk)
+
+        blocks = []
+        for row in range(0, n_questions, rows):
+            fused = np.einsum("cs,snm->cnm", chunk, stacked[:, row : row + rows])
+            indices, _ = top_k(fused.reshape(-1, n_choices), limit)
+            blocks.append(indices.reshape(n_combinations, fused.shape[1], -1))
+            del fused
+        indices = np.concatenate(blocks, axis=1) + 1
+
+        columns = {
+            f"combination_{start + offset}_question": indices[offset].tolist()
+            for offset in range(n_combinations)
+        }
+        df = pd.concat([annotations, pd.DataFrame(columns, index=annotations.index)], axis=1)
+        metrics, _ = evaluate_rankings(df, k=limit, truth=truth)
+        reports.append(metrics.drop(columns="right_questions"))
+
+    report = pd.concat(reports, ignore_index=True)
+    report = pd.concat([pd.DataFrame(combinations, columns=names), report], axis=1)
+    report["method"] = method
+
+    return report.sort_values(["accuracy", "mrr"], ascending=False, kind="stable")
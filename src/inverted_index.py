@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+import numpy as np
+
+from faq_index import FaqIndex
+
+
+def char_ngrams(token: str, n: int = 3) -> set[str]:
+    """Character n-grams of a token padded with spaces, e.g. ' pp', 'ppa', 'pa '."""
+
+    padded = f" {token} "
+    return {padded[i : i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+class InvertedIndex:
+    """Token and character n-gram postings over the normalized FAQ texts, used to
+    shortlist the FAQ entries worth scoring for each question."""
+
+    def __init__(self, faq_index: FaqIndex, ngram_size: int = 3, token_weight: float = 3.0):
+        self.size = len(faq_index)
+        self.ngram_size = ngram_size
+        self.token_weight = token_weight
+
+        token_postings = defaultdict(set)
+        ngram_postings = defaultdict(set)
+        for doc_id, tokens in enumerate(faq_index.tokens):
+            for token in tokens:
+                token_postings[token].add(doc_id)
+                for ngram in char_ngrams(token, ngram_size):
+                    ngram_postings[ngram].add(doc_id)
+
+        self.token_postings = {
+            key: np.fromiter(sorted(ids), dtype=np.int64) for key, ids in token_postings.items()
+        }
+        self.ngram_postings = {
+            key: np.fromiter(sorted(ids), dtype=np.int64) for key, ids in ngram_postings.items()
+        }
+        self.token_idf = {key: self.idf(ids.size) for key, ids in self.token_postings.items()}
+        self.ngram_idf = {key: self.idf(ids.size) for key, ids in self.ngram_postings.items()}
+
+        # Total weight of each entry, so scores measure how much of the entry the
+        # query covers instead of favouring the longest entries.
+        self.entry_weights = np.zeros(self.size, dtype=np.float64)
+        for key, ids in self.token_postings.items():
+            self.entry_weights[ids] += self.token_weight * self.token_idf[key]
+        for key, ids in self.ngram_postings.items():
+            self.entry_weights[ids] += self.ngram_idf[key]
+        self.entry_weights[self.entry_weights == 0] = 1.0
+
+    def idf(self, document_frequency: int) -> float:
+        return float(np.log(1 + self.size / document_frequency))
+
+    def overlap_scores(self, query: str) -> np.ndarray:
+        """Share of the IDF-weighted tokens and n-grams of each FAQ entry found in the query."""
+
+        tokens = set(query.split())
+        ngrams = set().union(*(char_ngrams(token, self.ngram_size) for token in tokens))
+
+        scores = np.zeros(self.size, dtype=np.float64)
+        for token in tokens:
+            if token in self.token_postings:
+                scores[self.token_postings[token]] += self.token_weight * self.token_idf[token]
+        for ngram in ngrams:
+            if ngram in self.ngram_postings:
+                scores[self.ngram_postings[ngram]] += self.ngram_idf[ngram]
+
+        return scores / self.entry_weights
+
+    def shortlist(self, queries: list[str], limit: int) -> np.ndarray:
+        """Return an (N x limit) array with the best candidates of each query, sorted
+        by FAQ position and padded with -1. Queries without any overlap keep the
+        first `limit` FAQ entries so they still get an answer."""
+
+        limit = min(limit, self.size)
+        candidates = np.full((len(queries), limit), -1, dtype=np.int64)
+
+        for row, query in enumerate(queries):
+            scores = self.overlap_scores(query)
+            hits = np.flatnonzero(scores)
+
+            if hits.size == 0:
+                candidates[row] = np.arange(limit)
+                continue
+
+            if hits.size > limit:
+                best = np.argsort(-scores[hits], kind="stable")[:limit]
+                hits = np.sort(hits[best])
+
+            candidates[row, : hits.size] = hits
+
+        return candidates
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from llm_config import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SAVE_SECONDS,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS,
+)
+
+ANSWER_CACHE_VERSION = 2
+ANSWER_CACHE_PATH = ".cache/answer_cache.npz"
+
+
+def cache_key(db: FAISS, *parts: str) -> str:
+    """Identifies what the answers were generated from: the chunks held by the
+    vector store (their IDs are derived from their content) and any other
+    input of the generation, such as the LLM and its system prompt."""
+
+    digest = hashlib.sha256(str(ANSWER_CACHE_VERSION).encode())
+    for chunk_id in sorted(db.index_to_docstore_id.values()):
+        digest.update(b"\0" + chunk_id.encode())
+    for part in parts:
+        digest.update(b"\1" + part.encode())
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    generation: str
+    vector: np.ndarray
+    created: float
+
+
+class SemanticCache:
+    """Answers of previous queries, served again for any query whose
+    embedding is within `threshold` cosine similarity of a cached one.
+
+    The `max_entries` most recently used answers are kept, each for at most
+    `ttl_seconds`. The cache is persisted to `path`, at most every
+    `save_seconds` (see `save`), and starts empty when `key` (see
+    `cache_key`) no longer matches the saved one, so a rebuilt vector store
+    never serves answers from the documents it replaced.
+
+    Its methods may be called from several threads at once (`main.py` runs
+    them off the event loop); queries are embedded outside the lock."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        key: str,
+        path: str = ANSWER_CACHE_PATH,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        save_seconds: float = ANSWER_CACHE_SAVE_SECONDS,
+    ):
+        self.embeddings = embeddings
+        self.key = key
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.save_seconds = save_seconds
+        self.entries: OrderedDict[str, CachedAnswer] = OrderedDict()
+        self.hits = self.misses = 0
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as saved:
+                metadata = json.loads(str(saved["metadata"]))
+                vectors = saved["vectors"]
+            if metadata["version"] == ANSWER_CACHE_VERSION and metadata["key"] == key:
+                for entry, vector in zip(metadata["entries"], vectors, strict=True):
+                    self.entries[entry["query"]] = CachedAnswer(
+                        entry["query"], entry["generation"], vector, entry["created"]
+                    )
+                self._expire()
+            else:
+                print("Answer cache is stale (vector store or prompt changed), starting empty.")
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return vector / max(np.linalg.norm(vector), 1e-12)
+
+    def _expire(self) -> None:
+        oldest = time.time() - self.ttl_seconds
+        for query in [query for query, entry in self.entries.items() if entry.created < oldest]:
+            del self.entries[query]
+
+    def lookup(self, query: str) -> tuple[str | None, np.ndarray | None]:
+        """Cached answer of the most similar query above the threshold, if any,
+        and the embedding of `query` if it was computed, to hand to `add` on a
+        miss instead of embedding the query again."""
+
+        with self.lock:
+            self._expire()
+            best = self.entries.get(query)
+            cached = list(self.entries.values())
+
+        vector = None
+        if best is None and cached:
+            vector = self._embed(query)
+            similarities = np.stack([entry.vector for entry in cached]) @ vector
+            i = int(np.argmax(similarities))
+            if similarities[i] >= self.threshold:
+                best = cached[i]
+
+        with self.lock:
+            if best is None:
+                self.misses += 1
+                return None, vector
+            if best.query in self.entries:
+                self.entries.move_to_end(best.query)
+            self.hits += 1
+            return best.generation, vector
+
+    def add(self, query: str, generation: str, vector: np.ndarray | None = None) -> None:
+        """Cache the answer of `query`, evicting the least recently used ones
+        beyond `max_entries`. `vector` is the query embedding `lookup`
+        returned, if any."""
+
+        vector = self._embed(query) if vector is None else vector
+        entry = CachedAnswer(query, generation, vector, time.time())
+        with self.lock:
+            self.entries[query] = entry
+            self.entries.move_to_end(query)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.dirty = True
+
+    def save(self, force: bool = True) -> None:
+        """Persist the cache if it changed. With `force=False`, only when the
+        last save is more than `save_seconds` old, so answering a query does
+        not rewrite the file every time; call `save()` at shutdown.
+
+        The vectors are stored as an array next to the JSON metadata in one
+        `.npz`, written under a temporary name and renamed, so a half-written
+        cache is never loaded."""
+
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty or (not force and time.monotonic() - self.saved_at < self.save_seconds):
+                    return
+                entries = list(self.entries.values())
+                # Cleared before writing: a concurrent add marks the cache dirty again
+                self.dirty = False
+                self.saved_at = time.monotonic()
+
+            metadata = {
+                "version": ANSWER_CACHE_VERSION,
+                "key": self.key,
+                "entries": [
+                    {"query": entry.query, "generation": entry.generation, "created": entry.created}
+                    for entry in entries
+                ],
+            }
+            vectors = [entry.vector for entry in entries]
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    metadata=np.array(json.dumps(metadata, ensure_ascii=False)),
+                    vectors=np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32),
+                )
+            os.replace(tmp_path, self.path)
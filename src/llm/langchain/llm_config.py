@@ -1,6 +1,9 @@
+import asyncio
 import os
+import time
 
 from dotenv import find_dotenv, load_dotenv
+from langchain_core.language_models import FakeListChatModel
 from langchain_openai import ChatOpenAI
 
 load_dotenv(find_dotenv())
@@ -8,6 +11,11 @@ load_dotenv(find_dotenv())
 LLAMA_API_KEY = os.getenv("LLAMA_API_KEY")
 LLAMA_API_BASE_URL = "https://api.llama-api.com"
 
+# LLM_STUB=1 replaces the LlamaAPI model with a local stub, to run the app
+# without an API key
+LLM_STUB = os.getenv("LLM_STUB", "0") == "1"
+LLM_STUB_LATENCY_SECONDS = float(os.getenv("LLM_STUB_LATENCY_SECONDS", "1.0"))
+
 
 def initialize_llama_api_llm(model_name: str = "deepseek-r1") -> ChatOpenAI:
     """Initializes and returns a ChatOpenAI instance configured for LlamaAPI."""
@@ -31,24 +39,82 @@ def initialize_llama_api_llm(model_name: str = "deepseek-r1") -> ChatOpenAI:
         raise
 
 
+class StubChatModel(FakeListChatModel):
+    """`FakeListChatModel` waiting `latency` seconds once per answer, before
+    the first token, instead of once per streamed character as its `sleep`
+    does."""
+
+    latency: float = 0.0
+
+    def _call(self, *args, **kwargs) -> str:
+        time.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        time.sleep(self.latency)
+        yield from super()._stream(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+def initialize_stub_llm(latency_seconds: float = LLM_STUB_LATENCY_SECONDS) -> StubChatModel:
+    """Local stand-in for the LLM that answers every prompt with the same
+    text after `latency_seconds`, for exercising the app without the API."""
+
+    print(f"Using the stub LLM ({latency_seconds}s per answer).")
+    return StubChatModel(responses=["Resposta de teste do LLM stub."], latency=latency_seconds)
+
+
+def initialize_llm() -> ChatOpenAI | StubChatModel:
+    return initialize_stub_llm() if LLM_STUB else initialize_llama_api_llm()
+
+
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
+# RecursiveCharacterTextSplitter parameters of the RAG chunks
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+
+# Ingestion embedding: sentences per forward pass, and sentence-transformers
+# processes (1 encodes in this process)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+
+# Semantic answer cache: minimum cosine similarity of a query to a cached one,
+# how many answers are kept and for how long, and how often it is saved
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+ANSWER_CACHE_SAVE_SECONDS = float(os.getenv("ANSWER_CACHE_SAVE_SECONDS", "60"))
+
+# Questions answered at the same time by serve.py
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "16"))
+
 SYSTEM_PROMPT = """
 
 Você é um especialista da Secretaria de Estado de Planejamento e Gestão (SEPLAG) do Estado do Rio de Janeiro.
 Você deve sanar as dúvidas dos  órgãos setoriais.
-As dúvidas podem estar relacionadas a legislação ou ao forma definidas por documentos anexados para sua consulta\
-ou sobre o sistema da SIPLAG (Sistema de Inteligência em Planejamento e Gestão) disponibilizado para a realização \
+As dúvidas podem estar relacionadas a legislação ou ao forma definidas por documentos anexados para sua \
+consulta\
+ou sobre o sistema da SIPLAG (Sistema de Inteligência em Planejamento e Gestão) disponibilizado para a \
+realização \
 do PPA (Plano Plurianual) de cada órgão setorial.
 
 Use exclusivamente os documentos anexos para responder, caso não encontre resposta nos documentos, \
 responda apenas "Não há tal informação na documentação."
 Fornceça respostas completas.
 
-O PPA é o documento onde um governo declara o que pretende realizar e indica os meios para a implementação das políticas públicas.\
-É nele que as diretrizes governamentais estabelecidas no plano de governo - mais amplas - ganham concretude, com a definição\
-dos caminhos exequíveis para o alcance dos objetivos pretendidos, materializados em iniciativas. As iniciativas, financiadas\
-por ações orçamentárias, detalham quais bens e serviços devem ser entregues para a população, em quais regiões do Estado e \
+O PPA é o documento onde um governo declara o que pretende realizar e indica os meios para a implementação \
+das políticas públicas.\
+É nele que as diretrizes governamentais estabelecidas no plano de governo - mais amplas - ganham concretude, \
+com a definição\
+dos caminhos exequíveis para o alcance dos objetivos pretendidos, materializados em iniciativas. As \
+iniciativas, financiadas\
+por ações orçamentárias, detalham quais bens e serviços devem ser entregues para a população, em quais \
+regiões do Estado e \
 em qual quantidade, para que seus objetivos sejam alcançados
 os órgãos setoriais são responsáveis pelas iniciativas e definem os elementos que as compõem.
 
@@ -1,75 +1,48 @@
+import asyncio
+import atexit
 import os
 import sys
+import time
 import traceback
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
 from typing import TypedDict
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+import numpy as np
+from answer_cache import SemanticCache, cache_key
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph
-from llm_config import EMBEDDING_MODEL_NAME, SYSTEM_PROMPT, initialize_llama_api_llm
+from llm_config import EMBEDDING_MODEL_NAME, SYSTEM_PROMPT, initialize_llm
+from vector_store import load_vector_store
 
-try:
-    llm = initialize_llama_api_llm()
-except ValueError as e:
-    print(f"Fatal Error: Could not initialize LLM. {e}")
-    sys.exit(1)  # Exit if LLM setup fails
-except Exception as e:
-    print(f"Fatal Error during LLM initialization: {e}")
-    sys.exit(1)
+PDF_FILE_PATHS = [
+    "../llama_index/pdfs/manual_de_revisao_PPA_2025.pdf",
+    "../llama_index/pdfs/manual_de_monitoramento_PPA_2024-2027.pdf",
+    "../llama_index/pdfs/manual_de_elaboracao_PPA_24-27.pdf",
+    "../llama_index/pdfs/guia_operacional_SIPLAG_PPA_24-27.pdf",
+    "../llama_index/pdfs/faq_PPA_SIPLAG.pdf",
+    "../llama_index/pdfs/decreto_ASPLOS.pdf",
+    "../llama_index/pdfs/resolucao_monitoramento_2025_ppa",
+]
 
+# Initialized by `init_rag`, not at import: the worker processes that parse
+# the PDFs re-import this module
+llm = None
 
-# --- 1. Document Loading and Processing (Function remains the same) ---
+
+# --- 1. Document Loading and Processing ---
 def load_and_process_pdfs(pdf_paths: list[str], embedding_model_name: str):
-    """Loads specific PDFs from a list, splits them, creates embeddings, and returns a retriever."""
-    all_docs: list[Document] = []
-    print("\n--- Loading and Processing PDFs ---")
+    """Loads the persisted vector store of the PDFs, ingesting only new or
+    revised ones (see `vector_store.py` to add or remove PDFs by hand), and
+    returns a retriever."""
     print(f"Using embedding model: {embedding_model_name}")
 
-    for pdf_path in pdf_paths:
-        if not os.path.exists(pdf_path):
-            print(f"Warning: PDF file not found at {pdf_path}. Skipping.")
-            continue
-        try:
-            print(f"Loading: {pdf_path}")
-            loader = PyPDFLoader(pdf_path)
-            documents = loader.load()
-            all_docs.extend(documents)
-            print(f"Loaded {len(documents)} pages from {os.path.basename(pdf_path)}.")
-        except Exception as e:
-            print(f"Error loading {pdf_path}: {e}")
-
-    if not all_docs:
-        print("Error: No documents were successfully loaded. Cannot proceed.")
-        return None
-
-    print(f"\nTotal documents loaded: {len(all_docs)}")
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-    split_docs = text_splitter.split_documents(all_docs)
-    print(f"Split into {len(split_docs)} text chunks.")
-
-    if not split_docs:
-        print("Error: No text chunks generated after splitting. Cannot create vector store.")
-        return None
-
-    print(f"Initializing embedding model: {embedding_model_name}")
-    try:
-        embeddings = HuggingFaceEmbeddings(model_name=embedding_model_name)
-    except Exception as e:
-        print(f"Error initializing embedding model: {e}")
+    db = load_vector_store(pdf_paths, embedding_model_name)
+    if db is None:
         return None
 
-    print("Creating FAISS vector store in memory...")
-    try:
-        db = FAISS.from_documents(split_docs, embeddings)
-        print("Vector store created successfully.")
-        return db.as_retriever(search_kwargs={"k": 5})  # Retrieve top 5
-    except Exception as e:
-        print(f"Error creating FAISS vector store: {e}")
-        return None
+    print("Vector store ready.")
+    return db.as_retriever(search_kwargs={"k": 5})  # Retrieve top 5
 
 
 class AgentState(TypedDict):
@@ -77,9 +50,11 @@ class AgentState(TypedDict):
     documents: list[str]
     generation: str
     iterations: int
+    answered: bool
 
 
 retriever = None
+answer_cache: SemanticCache | None = None
 
 
 def retrieve_docs(state: AgentState) -> AgentState:
@@ -116,19 +91,9 @@ def grade_documents(state: AgentState) -> AgentState:
     return {"documents": documents}
 
 
-def generate_answer(state: AgentState) -> AgentState:
-    """Generates an answer using the LLM based on the query and retrieved documents."""
-    print("---NODE: GENERATE ANSWER---")
-    query = state["query"]
-    documents = state["documents"]
-
-    if not documents:
-        print("No relevant documents found to generate answer.")
-        generation = "I couldn't find relevant information in the provided documents to answer your question."
-        return {"generation": generation}
-
+def answer_prompt(query: str, documents: list[str]) -> str:
     context = "\n\n".join(documents)
-    prompt = f"""{SYSTEM_PROMPT}".
+    return f"""{SYSTEM_PROMPT}".
 
 Context:
 {context}
@@ -137,16 +102,55 @@ Question: {query}
 
 Answer:"""
 
+
+def _generation_prompt(state: AgentState) -> str | None:
+    """Prompt of the answer, or None when no documents were retrieved."""
+    print("---NODE: GENERATE ANSWER---")
+    if not state["documents"]:
+        print("No relevant documents found to generate answer.")
+        return None
     print("Generating answer with LLM...")
+    return answer_prompt(state["query"], state["documents"])
+
+
+def _no_documents_answer() -> AgentState:
+    return {
+        "generation": "I couldn't find relevant information in the provided documents to answer your question."
+    }
+
+
+def _llm_answer(response) -> AgentState:
+    generation = response.content
+    print(f"LLM Generation done ({len(generation)} characters).")
+    return {"generation": generation, "answered": True}
+
+
+def _llm_error(e: Exception) -> AgentState:
+    print(f"Error during LLM generation: {e}")
+    return {"generation": "Sorry, I encountered an error while generating the answer."}
+
+
+def generate_answer(state: AgentState) -> AgentState:
+    """Generates an answer using the LLM based on the query and retrieved documents."""
+    prompt = _generation_prompt(state)
+    if prompt is None:
+        return _no_documents_answer()
     try:
-        response = llm.invoke(prompt)
-        generation = response.content
-        print(f"LLM Generation: {generation}")
+        return _llm_answer(llm.invoke(prompt))
     except Exception as e:
-        print(f"Error during LLM generation: {e}")
-        generation = "Sorry, I encountered an error while generating the answer."
+        return _llm_error(e)
 
-    return {"generation": generation}
+
+async def agenerate_answer(state: AgentState) -> AgentState:
+    """`generate_answer` for `app.ainvoke`, awaiting the LLM instead of
+    blocking a thread for the whole generation."""
+    prompt = _generation_prompt(state)
+    if prompt is None:
+        return _no_documents_answer()
+    try:
+        return _llm_answer(await llm.ainvoke(prompt))
+    except Exception as e:
+        return _llm_error(e)
 
 
 def fallback(state: AgentState) -> AgentState:
@@ -155,7 +159,9 @@ def fallback(state: AgentState) -> AgentState:
     if not state.get("documents"):
         generation = "I could not find relevant information in the specified documents to answer your query."
     else:
-        generation = "Sorry, I encountered an issue and could not process your request based on the documents."
+        generation = (
+            "Sorry, I encountered an issue and could not process your request based on the documents."
+        )
     return {"generation": generation}
 
 
@@ -183,7 +189,7 @@ workflow = StateGraph(AgentState)
 
 workflow.add_node("retrieve", retrieve_docs)
 workflow.add_node("grade_documents", grade_documents)
-workflow.add_node("generate", generate_answer)
+workflow.add_node("generate", RunnableLambda(generate_answer, afunc=agenerate_answer))
 workflow.add_node("fallback", fallback)
 
 workflow.set_entry_point("retrieve")
@@ -200,26 +206,179 @@ workflow.add_edge("fallback", END)
 app = workflow.compile()
 print("Graph compiled successfully.")
 
+
+def init_rag(pdf_paths: list[str]) -> bool:
+    """Initializes the LLM and loads the retriever and the answer cache
+    shared by every query. Returns whether everything is ready."""
+    global llm, retriever, answer_cache
+
+    try:
+        llm = initialize_llm()
+    except ValueError as e:
+        print(f"Fatal Error: Could not initialize LLM. {e}")
+        return False
+    except Exception as e:
+        print(f"Fatal Error during LLM initialization: {e}")
+        return False
+
+    retriever = load_and_process_pdfs(pdf_paths, EMBEDDING_MODEL_NAME)
+    if retriever is None:
+        return False
+
+    db = retriever.vectorstore
+    llm_name = getattr(llm, "model_name", type(llm).__name__)
+    answer_cache = SemanticCache(db.embedding_function, cache_key(db, llm_name, SYSTEM_PROMPT))
+    # Answers cached since the last periodic save are written on exit
+    atexit.register(answer_cache.save)
+    print(f"Answer cache: {len(answer_cache)} answers.")
+    return True
+
+
+def _graph_input(query: str) -> tuple[dict, dict]:
+    return {"query": query, "iterations": 0}, {"recursion_limit": 5}
+
+
+def _lookup(query: str) -> tuple[str | None, np.ndarray | None]:
+    if answer_cache is None:
+        return None, None
+    return answer_cache.lookup(query)
+
+
+def _cache_answer(query: str, final_state: dict, vector: np.ndarray | None) -> str:
+    generation = final_state.get("generation", "No generation found in final state.")
+    if answer_cache is not None and final_state.get("answered"):
+        answer_cache.add(query, generation, vector)
+        answer_cache.save(force=False)
+    return generation
+
+
+def answer_query(query: str) -> str:
+    """Answer from the semantic cache when a similar query was answered
+    before, and from the graph otherwise. Only answers the LLM actually
+    generated are cached, never fallbacks or errors."""
+
+    cached, vector = _lookup(query)
+    if cached is not None:
+        print(f"---ANSWER CACHE HIT ({answer_cache.hits} hits, {answer_cache.misses} misses)---")
+        return cached
+
+    return _cache_answer(query, app.invoke(*_graph_input(query)), vector)
+
+
+async def aanswer_query(query: str) -> str:
+    """`answer_query` through `app.ainvoke`, so many queries can be answered
+    concurrently on one event loop. The cache is looked up and written in a
+    worker thread: embedding the query and saving the cache would otherwise
+    block every other query on the loop."""
+
+    cached, vector = await asyncio.to_thread(_lookup, query)
+    if cached is not None:
+        print(f"---ANSWER CACHE HIT ({answer_cache.hits} hits, {answer_cache.misses} misses)---")
+        return cached
+
+    final_state = await app.ainvoke(*_graph_input(query))
+    return await asyncio.to_thread(_cache_answer, query, final_state, vector)
+
+
+@dataclass
+class StreamStats:
+    """Latency of a streamed answer, measured from the moment the query was
+    submitted."""
+
+    ttft_seconds: float = 0.0
+    total_seconds: float = 0.0
+    tokens: int = 0
+    cached: bool = False
+
+
+def _answer_token(mode: str, payload) -> str:
+    """Text of an LLM token streamed by the generate node, or "" for any
+    other stream event."""
+
+    if mode != "messages":
+        return ""
+    chunk, metadata = payload
+    if metadata.get("langgraph_node") != "generate" or not isinstance(chunk.content, str):
+        return ""
+    return chunk.content
+
+
+def stream_answer(query: str, on_token: Callable[[str], None]) -> tuple[str, StreamStats]:
+    """`answer_query` handing the LLM tokens to `on_token` as they arrive.
+    Cached answers and answers the LLM did not generate (fallbacks, errors)
+    are handed over whole, so `on_token` always receives the full answer."""
+
+    start = time.perf_counter()
+    stats = StreamStats()
+
+    cached, vector = _lookup(query)
+    if cached is not None:
+        on_token(cached)
+        stats.ttft_seconds = stats.total_seconds = time.perf_counter() - start
+        stats.tokens, stats.cached = 1, True
+        return cached, stats
+
+    final_state = {}
+    for mode, payload in app.stream(*_graph_input(query), stream_mode=["messages", "values"]):
+        if mode == "values":
+            final_state = payload
+        elif token := _answer_token(mode, payload):
+            if not stats.tokens:
+                stats.ttft_seconds = time.perf_counter() - start
+            stats.tokens += 1
+            on_token(token)
+
+    generation = _cache_answer(query, final_state, vector)
+    if not stats.tokens:
+        on_token(generation)
+        stats.ttft_seconds = time.perf_counter() - start
+    stats.total_seconds = time.perf_counter() - start
+    return generation, stats
+
+
+async def astream_answer(query: str, on_token: Callable[[str], Awaitable[None]]) -> tuple[str, StreamStats]:
+    """`stream_answer` through `app.astream`, awaiting `on_token` for every
+    token so a slow client applies backpressure to its own answer only. Like
+    `aanswer_query`, the cache is used from a worker thread."""
+
+    start = time.perf_counter()
+    stats = StreamStats()
+
+    cached, vector = await asyncio.to_thread(_lookup, query)
+    if cached is not None:
+        await on_token(cached)
+        stats.ttft_seconds = stats.total_seconds = time.perf_counter() - start
+        stats.tokens, stats.cached = 1, True
+        return cached, stats
+
+    final_state = {}
+    async for mode, payload in app.astream(*_graph_input(query), stream_mode=["messages", "values"]):
+        if mode == "values":
+            final_state = payload
+        elif token := _answer_token(mode, payload):
+            if not stats.tokens:
+                stats.ttft_seconds = time.perf_counter() - start
+            stats.tokens += 1
+            await on_token(token)
+
+    generation = await asyncio.to_thread(_cache_answer, query, final_state, vector)
+    if not stats.tokens:
+        await on_token(generation)
+        stats.ttft_seconds = time.perf_counter() - start
+    stats.total_seconds = time.perf_counter() - start
+    return generation, stats
+
+
 # --- 7. Run the Agent ---
 if __name__ == "__main__":
-    pdf_file_paths = [
-        "../llama_index/pdfs/manual_de_revisao_PPA_2025.pdf",
-        "../llama_index/pdfs/manual_de_monitoramento_PPA_2024-2027.pdf",
-        "../llama_index/pdfs/manual_de_elaboracao_PPA_24-27.pdf",
-        "../llama_index/pdfs/guia_operacional_SIPLAG_PPA_24-27.pdf",
-        "../llama_index/pdfs/faq_PPA_SIPLAG.pdf",
-        "../llama_index/pdfs/decreto_ASPLOS.pdf",
-        "../llama_index/pdfs/resolucao_monitoramento_2025_ppa",
-    ]
+    pdf_file_paths = PDF_FILE_PATHS
 
     if not pdf_file_paths:
         print("\nError: No PDF file paths provided in the 'pdf_file_paths' list.")
         sys.exit(1)
 
-    retriever = load_and_process_pdfs(pdf_file_paths, EMBEDDING_MODEL_NAME)
-
-    if retriever is None:
-        print("\nFailed to initialize the document retriever. Exiting.")
+    if not init_rag(pdf_file_paths):
+        print("\nFailed to initialize the LLM or the document retriever. Exiting.")
         sys.exit(1)
 
     print("\n--- Agentic RAG System Ready ---")
@@ -237,12 +396,13 @@ if __name__ == "__main__":
         if not user_query:
             continue
 
-        initial_state = {"query": user_query, "iterations": 0}
-
         try:
-            final_state = app.invoke(initial_state, {"recursion_limit": 5})
             print("\n--- Final Answer ---")
-            print(final_state.get("generation", "No generation found in final state."))
+            _, stats = stream_answer(user_query, lambda token: print(token, end="", flush=True))
+            print(
+                f"\n[first token {stats.ttft_seconds:.2f}s, total {stats.total_seconds:.2f}s, "
+                f"{stats.tokens} tokens{', cached' if stats.cached else ''}]"
+            )
             print("-" * 20)
         except Exception as e:
             print(f"\nAn error occurred during graph execution: {e}")
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_config import RAG_MAX_CONCURRENCY
+
+
+async def answer(rag, query: str, semaphore: asyncio.Semaphore, on_token=None) -> dict:
+    """Answer one query once a concurrency slot is free, with its latency
+    measured from the moment it was submitted, and the part of it spent
+    waiting for the slot. With `on_token`, the answer is streamed to it
+    token by token, and the time to the first token is reported as well."""
+
+    start = time.perf_counter()
+    async with semaphore:
+        queued = time.perf_counter() - start
+        try:
+            if on_token is None:
+                response = {"generation": await rag.aanswer_query(query)}
+            else:
+                generation, stats = await rag.astream_answer(query, on_token)
+                response = {
+                    "generation": generation,
+                    "ttft_seconds": round(queued + stats.ttft_seconds, 3),
+                    "tokens": stats.tokens,
+                    "cached": stats.cached,
+                }
+        except Exception as e:
+            print(f"Error answering {query!r}: {e}")
+            response = {"error": str(e)}
+        response["queue_seconds"] = round(queued, 3)
+        response["seconds"] = round(time.perf_counter() - start, 3)
+        return response
+
+
+async def serve_jsonl(rag, semaphore: asyncio.Semaphore, out) -> None:
+    """Read `{"id": ..., "query": ...}` lines from stdin and write one
+    `{"id": ..., "generation": ..., "seconds": ...}` line per query as soon as
+    it is answered, so responses come back in completion order.
+
+    A request with `"stream": true` is first answered with one
+    `{"id": ..., "token": ...}` line per token as the LLM generates them."""
+
+    def write(response: dict) -> None:
+        out.write(json.dumps(response, ensure_ascii=False) + "\n")
+        out.flush()
+
+    async def handle(line: str) -> None:
+        id_ = None
+        try:
+            request = json.loads(line)
+            id_ = request.get("id")
+
+            async def on_token(token: str) -> None:
+                write({"id": id_, "token": token})
+
+            on_token = on_token if request.get("stream") else None
+            response = {"id": id_, **await answer(rag, request["query"], semaphore, on_token)}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            response = {"id": id_, "error": f"Invalid request: {e}"}
+        write(response)
+
+    tasks = set()
+    while line := await asyncio.to_thread(sys.stdin.readline):
+        if line.strip():
+            task = asyncio.create_task(handle(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks)
+
+
+async def handle_http(rag, semaphore: asyncio.Semaphore, reader, writer) -> None:
+    """Minimal HTTP/1.1 handler: `POST /ask` with a `{"query": ...}` JSON body
+    returns `{"generation": ..., "seconds": ...}`, or a 500 with
+    `{"error": ...}` when the query could not be answered. One request per
+    connection.
+
+    With `"stream": true` in the body, the response is chunked NDJSON: one
+    `{"token": ...}` line per token as the LLM generates them, then the
+    line of the whole answer."""
+
+    request = None
+    try:
+        method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        if (method, path) != ("POST", "/ask"):
+            status, payload = "404 Not Found", {"error": 'POST {"query": ...} to /ask'}
+        else:
+            request = json.loads(body)
+            if not isinstance(request.get("query"), str):
+                raise ValueError('the body must be {"query": "..."}')
+    except (ValueError, TypeError, AttributeError, asyncio.IncompleteReadError) as e:
+        request = None
+        status, payload = "400 Bad Request", {"error": f"Invalid request: {e}"}
+
+    with contextlib.suppress(ConnectionError):
+        if request is not None and request.get("stream"):
+            # The status line waits for the first line of the body, so a query
+            # that fails before its first token still gets a 500
+            started = False
+
+            async def send(payload: dict) -> None:
+                nonlocal started
+                if not started:
+                    status = "500 Internal Server Error" if "error" in payload else "200 OK"
+                    writer.write(
+                        f"HTTP/1.1 {status}\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                        "Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n".encode("latin-1")
+                    )
+                    started = True
+                data = (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+                writer.write(f"{len(data):X}\r\n".encode("latin-1") + data + b"\r\n")
+                await writer.drain()
+
+            await send(await answer(rag, request["query"], semaphore, lambda token: send({"token": token})))
+            writer.write(b"0\r\n\r\n")
+        else:
+            if request is not None:
+                payload = await answer(rag, request["query"], semaphore)
+                status = "500 Internal Server Error" if "error" in payload else "200 OK"
+
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                + data
+            )
+
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serve(rag, concurrency: int, host: str, port: int | None, out) -> None:
+    # Retrieval runs in the loop's default executor (the graph's sync nodes),
+    # sized so that it never becomes a tighter bound than the semaphore: one
+    # thread per query, plus the one `serve_jsonl` blocks reading stdin
+    executor = ThreadPoolExecutor(max_workers=concurrency + 1)
+    asyncio.get_running_loop().set_default_executor(executor)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    if port is None:
+        print(f"Answering JSONL queries from stdin, {concurrency} at a time.")
+        await serve_jsonl(rag, semaphore, out)
+        return
+
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_http(rag, semaphore, reader, writer), host, port
+    )
+    print(f"Answering POST /ask on http://{host}:{port}, {concurrency} at a time.")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the RAG agent to many concurrent users, over JSONL on stdin/stdout or HTTP."
+    )
+    parser.add_argument("--http", type=int, default=None, metavar="PORT", help="Serve HTTP instead of JSONL.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--concurrency", type=int, default=RAG_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    # Stdout carries the JSONL responses only: the progress the agent prints,
+    # from the graph construction at import onwards, goes to stderr
+    out = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        rag = importlib.import_module("main")
+        if not rag.init_rag(rag.PDF_FILE_PATHS):
+            print("\nFailed to initialize the LLM or the document retriever. Exiting.")
+            sys.exit(1)
+
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(serve(rag, args.concurrency, args.host, args.http, out))
@@ -0,0 +1,428 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_huggingface import HuggingFaceEmbeddings
+from llm_config import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_WORKERS,
+)
+
+VECTOR_STORE_VERSION = 1
+VECTOR_STORE_DIR = ".cache/vector_store"
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of the file contents."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_key(embedding_model_name: str, chunk_size: int, chunk_overlap: int) -> str:
+    """Identifies the chunks and embeddings a store holds: the splitter
+    parameters and the embedding model. Documents are tracked one by one in
+    the store's manifest."""
+
+    digest = hashlib.sha256()
+    digest.update(f"{VECTOR_STORE_VERSION}|{embedding_model_name}|{chunk_size}|{chunk_overlap}".encode())
+    return digest.hexdigest()
+
+
+def document_path(pdf_path: str) -> str:
+    """Key of a PDF in the manifest: its normalized absolute path, so a PDF
+    given relative to another working directory is not ingested twice."""
+
+    return os.path.normcase(os.path.abspath(pdf_path))
+
+
+def chunk_ids(pdf_path: str, chunks: list[Document]) -> list[str]:
+    """Stable IDs of a document's chunks, derived from the document path and
+    each chunk's page and text, so an unchanged chunk keeps its ID (and its
+    embedding) across revisions of the PDF."""
+
+    document_key = hashlib.sha256(os.path.normpath(pdf_path).encode()).hexdigest()[:12]
+    seen: dict[str, int] = {}
+    ids = []
+    for chunk in chunks:
+        content = f"{chunk.metadata.get('page')}|{chunk.page_content}"
+        chunk_hash = hashlib.sha256(content.encode()).hexdigest()[:16]
+        occurrence = seen[chunk_hash] = seen.get(chunk_hash, -1) + 1
+        ids.append(f"{document_key}-{chunk_hash}-{occurrence}")
+    return ids
+
+
+def split_documents(
+    documents: list[Document], chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP
+) -> list[Document]:
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(documents)
+
+
+@dataclass
+class ParsedPdf:
+    """Chunks of one PDF, or the error that stopped it, and how long it took."""
+
+    path: str
+    pages: int = 0
+    chunks: list[Document] = field(default_factory=list)
+    seconds: float = 0.0
+    error: str | None = None
+
+
+def parse_pdf(pdf_path: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> ParsedPdf:
+    """Load and chunk one PDF. Errors are returned instead of raised, so one
+    unreadable file never takes the others down with it."""
+
+    start = time.perf_counter()
+    try:
+        pages = PyPDFLoader(pdf_path).load()
+        chunks = split_documents(pages, chunk_size, chunk_overlap)
+        return ParsedPdf(pdf_path, len(pages), chunks, time.perf_counter() - start)
+    except Exception as e:
+        return ParsedPdf(pdf_path, seconds=time.perf_counter() - start, error=str(e))
+
+
+def parse_pdfs(
+    pdf_paths: list[str],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    workers: int | None = None,
+) -> list[ParsedPdf]:
+    """Load and chunk the PDFs in a pool of `workers` processes (one per CPU
+    by default), returned in the order of `pdf_paths` whatever order they
+    finish in."""
+
+    workers = min(workers or os.cpu_count() or 1, len(pdf_paths))
+    start = time.perf_counter()
+
+    if workers <= 1:
+        parsed = [parse_pdf(path, chunk_size, chunk_overlap) for path in pdf_paths]
+    else:
+        # Spawned, not forked: the embedding model is already loaded, and forking
+        # a process that ran PyTorch's thread pools can deadlock the children.
+        # Spawned workers re-import the calling script, which must guard its entry point
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            n = len(pdf_paths)
+            parsed = list(executor.map(parse_pdf, pdf_paths, [chunk_size] * n, [chunk_overlap] * n))
+
+    for pdf in parsed:
+        if pdf.error is not None:
+            print(f"Error loading {pdf.path}: {pdf.error} ({pdf.seconds:.2f}s)")
+        else:
+            print(
+                f"Loaded {pdf.pages} pages, {len(pdf.chunks)} chunks from "
+                f"{os.path.basename(pdf.path)} in {pdf.seconds:.2f}s."
+            )
+    if parsed:
+        print(f"Parsed {len(parsed)} PDFs with {workers} workers in {time.perf_counter() - start:.2f}s.")
+
+    return parsed
+
+
+def embed_texts(
+    embeddings: HuggingFaceEmbeddings,
+    texts: list[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    workers: int = EMBEDDING_WORKERS,
+    batches_per_step: int = 8,
+) -> list[list[float]]:
+    """Document embeddings of `texts`, in input order, as `embed_documents`
+    would compute them.
+
+    The texts are encoded longest first, so every batch pads to a similar
+    length, in steps of `batches_per_step` batches per worker with the
+    progress and throughput printed after each. `workers > 1` spreads the
+    batches over a sentence-transformers multi-process pool; its processes
+    are spawned, so the calling script must guard its entry point."""
+
+    if not texts:
+        return []
+
+    # The SentenceTransformer behind the LangChain wrapper, so the query side
+    # of the store keeps using the same weights and encode settings
+    model = embeddings._client
+    encode_kwargs = {**embeddings.encode_kwargs, "batch_size": batch_size}
+
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    step = batch_size * batches_per_step * max(workers, 1)
+    vectors: list[list[float] | None] = [None] * len(texts)
+
+    pool = model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+    start = time.perf_counter()
+    try:
+        for position in range(0, len(order), step):
+            indices = order[position : position + step]
+            batch = [texts[i] for i in indices]
+            if pool is None:
+                encoded = model.encode(batch, **encode_kwargs)
+            else:
+                encoded = model.encode_multi_process(batch, pool, **encode_kwargs)
+
+            for i, vector in zip(indices, encoded.tolist(), strict=True):
+                vectors[i] = vector
+
+            done = position + len(indices)
+            elapsed = time.perf_counter() - start
+            print(f"Embedded {done}/{len(texts)} chunks ({done / elapsed:.1f} chunks/s).")
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    return vectors
+
+
+class IncrementalVectorStore:
+    """FAISS store of the PDF chunks persisted in `cache_dir`, with a manifest
+    of the content hash and chunk IDs of every document.
+
+    Adding a new or revised PDF embeds only the chunks the store does not
+    hold yet and deletes the ones the revision dropped; removing a PDF
+    deletes its chunks. Nothing else is re-embedded."""
+
+    def __init__(
+        self,
+        embedding_model_name: str = EMBEDDING_MODEL_NAME,
+        cache_dir: str = VECTOR_STORE_DIR,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = CHUNK_OVERLAP,
+        workers: int | None = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        embedding_workers: int = EMBEDDING_WORKERS,
+    ):
+        self.embedding_model_name = embedding_model_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.workers = workers
+        self.batch_size = batch_size
+        self.embedding_workers = embedding_workers
+        self.path = os.path.join(cache_dir, store_key(embedding_model_name, chunk_size, chunk_overlap)[:16])
+
+        print(f"Initializing embedding model: {embedding_model_name}")
+        self.embeddings = HuggingFaceEmbeddings(model_name=embedding_model_name)
+
+        # A save interrupted between its two renames leaves the previous store aside
+        if not os.path.exists(self.path) and os.path.exists(f"{self.path}.old"):
+            os.replace(f"{self.path}.old", self.path)
+
+        self.db: FAISS | None = None
+        if os.path.exists(os.path.join(self.path, "index.faiss")):
+            # Only stores this pipeline saved itself are ever deserialized
+            self.db = FAISS.load_local(self.path, self.embeddings, allow_dangerous_deserialization=True)
+
+        self.documents: dict[str, dict] = {}
+        # Whether the manifest was migrated on load, so the store needs saving
+        self.migrated = False
+        if os.path.exists(os.path.join(self.path, "manifest.json")):
+            print(f"Loading FAISS vector store from {self.path}...")
+            with open(os.path.join(self.path, "manifest.json"), encoding="utf-8") as f:
+                documents = json.load(f)["documents"]
+            # Manifests used to be keyed by the path as given, relative to the
+            # working directory of the run that ingested the PDF
+            for pdf_path, entry in documents.items():
+                key = document_path(pdf_path)
+                if key in self.documents:
+                    print(f"{pdf_path}: ingested twice under different paths, dropping the copy.")
+                    self._delete(entry["chunk_ids"])
+                else:
+                    self.documents[key] = entry
+                self.migrated = self.migrated or key != pdf_path
+
+    def save(self) -> None:
+        """Saved under a temporary name and renamed, so a half-written store is
+        never loaded. The previous store is renamed aside, not deleted, until
+        the new one is in place."""
+
+        tmp_path = f"{self.path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        if self.db is not None:
+            self.db.save_local(tmp_path)
+        with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+            manifest = {
+                "version": VECTOR_STORE_VERSION,
+                "embedding_model_name": self.embedding_model_name,
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "documents": self.documents,
+            }
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        old_path = f"{self.path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        print(f"Vector store saved to {self.path}.")
+
+    def _delete(self, ids: list[str]) -> None:
+        if ids and self.db is not None:
+            self.db.delete(ids)
+
+    def add(self, pdf_paths: list[str]) -> bool:
+        """Ingest new PDFs and re-ingest revised ones. Returns whether the store changed."""
+
+        hashes = {}
+        for pdf_path in dict.fromkeys(map(document_path, pdf_paths)):
+            if not os.path.exists(pdf_path):
+                print(f"Warning: PDF file not found at {pdf_path}. Skipping.")
+                continue
+
+            pdf_hash = file_hash(pdf_path)
+            entry = self.documents.get(pdf_path)
+            if entry is None or entry["hash"] != pdf_hash:
+                hashes[pdf_path] = pdf_hash
+
+        changed = False
+        new_ids: list[str] = []
+        new_docs: list[Document] = []
+        for pdf in parse_pdfs(list(hashes), self.chunk_size, self.chunk_overlap, self.workers):
+            pdf_path, chunks = pdf.path, pdf.chunks
+            if pdf.error is not None:
+                continue
+            if not chunks:
+                print(f"Error: No text chunks generated from {pdf_path}. Skipping.")
+                continue
+
+            entry = self.documents.get(pdf_path)
+            ids = chunk_ids(pdf_path, chunks)
+            old_ids = set() if entry is None else set(entry["chunk_ids"])
+            new_chunks = [(id_, chunk) for id_, chunk in zip(ids, chunks, strict=True) if id_ not in old_ids]
+
+            self._delete(sorted(old_ids - set(ids)))
+            new_ids.extend(id_ for id_, _ in new_chunks)
+            new_docs.extend(chunk for _, chunk in new_chunks)
+
+            print(
+                f"{os.path.basename(pdf_path)}: {len(chunks)} chunks, {len(new_chunks)} to embed, "
+                f"{len(old_ids - set(ids))} deleted."
+            )
+            self.documents[pdf_path] = {"hash": hashes[pdf_path], "chunk_ids": ids}
+            changed = True
+
+        # The new chunks of every PDF are embedded together, for full batches
+        if new_docs:
+            vectors = embed_texts(
+                self.embeddings,
+                [doc.page_content for doc in new_docs],
+                self.batch_size,
+                self.embedding_workers,
+            )
+            text_embeddings = [
+                (doc.page_content, vector) for doc, vector in zip(new_docs, vectors, strict=True)
+            ]
+            metadatas = [doc.metadata for doc in new_docs]
+            if self.db is None:
+                self.db = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas, ids=new_ids)
+            else:
+                self.db.add_embeddings(text_embeddings, metadatas, ids=new_ids)
+
+        return changed
+
+    def remove(self, pdf_paths: list[str]) -> bool:
+        """Delete the chunks of the given PDFs. Returns whether the store changed."""
+
+        changed = False
+        for pdf_path in pdf_paths:
+            entry = self.documents.pop(document_path(pdf_path), None)
+            if entry is None:
+                print(f"Warning: {pdf_path} is not in the vector store. Skipping.")
+                continue
+
+            self._delete(entry["chunk_ids"])
+            print(f"{os.path.basename(pdf_path)}: {len(entry['chunk_ids'])} chunks deleted.")
+            changed = True
+
+        return changed
+
+
+def load_vector_store(
+    pdf_paths: list[str],
+    embedding_model_name: str = EMBEDDING_MODEL_NAME,
+    cache_dir: str = VECTOR_STORE_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    workers: int | None = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    embedding_workers: int = EMBEDDING_WORKERS,
+) -> FAISS | None:
+    """FAISS store of the PDF chunks, brought up to date incrementally: new or
+    revised PDFs are ingested and PDFs whose file disappeared are removed.
+    When nothing changed, the saved store is loaded as is. PDFs are parsed in
+    `workers` processes and their chunks embedded in batches of `batch_size`
+    over `embedding_workers` processes."""
+
+    try:
+        store = IncrementalVectorStore(
+            embedding_model_name, cache_dir, chunk_size, chunk_overlap, workers, batch_size, embedding_workers
+        )
+    except Exception as e:
+        print(f"Error initializing vector store: {e}")
+        return None
+
+    missing = [path for path in store.documents if not os.path.exists(path)]
+    changed = store.remove(missing) or store.migrated
+    changed = store.add(pdf_paths) or changed
+    if changed:
+        store.save()
+
+    if store.db is None or not store.documents:
+        print("Error: No documents were successfully loaded. Cannot proceed.")
+        return None
+
+    return store.db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add or remove PDFs from the RAG vector store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("add", help="Ingest new or revised PDFs.").add_argument("pdfs", nargs="+")
+    subparsers.add_parser("remove", help="Delete the chunks of PDFs.").add_argument("pdfs", nargs="+")
+    subparsers.add_parser("list", help="List the ingested PDFs.")
+    parser.add_argument("--cache-dir", default=VECTOR_STORE_DIR)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="PDF parsing processes (default: one per CPU)."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="Chunks per forward pass."
+    )
+    parser.add_argument(
+        "--embedding-workers",
+        type=int,
+        default=EMBEDDING_WORKERS,
+        help="sentence-transformers embedding processes.",
+    )
+    args = parser.parse_args()
+
+    store = IncrementalVectorStore(
+        cache_dir=args.cache_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        embedding_workers=args.embedding_workers,
+    )
+
+    if args.command == "list":
+        for path, entry in store.documents.items():
+            print(f"{path}\t{entry['hash'][:12]}\t{len(entry['chunk_ids'])} chunks")
+    elif (store.add if args.command == "add" else store.remove)(args.pdfs) or store.migrated:
+        store.save()
@@ -1,5 +1,29 @@
+import argparse
+import contextlib
+import csv
+import json
+import sys
+from collections.abc import Iterator
+from itertools import batched
+
 import pandas as pd
-from rapidfuzz import fuzz, process, utils
+from rapidfuzz import fuzz
+
+from faq_index import FaqIndex, load_faq_index
+from matching import extract_top_k
+from utils import read_excel_cached
+
+SCORERS = (
+    fuzz.ratio,
+    fuzz.partial_ratio,
+    fuzz.token_set_ratio,
+    fuzz.partial_token_set_ratio,
+    fuzz.token_sort_ratio,
+    fuzz.partial_token_sort_ratio,
+    fuzz.token_ratio,
+    fuzz.partial_token_ratio,
+    fuzz.WRatio,
+)
 
 
 def create_dataframe(
@@ -20,43 +44,101 @@ def create_dataframe(
     return pd.DataFrame(df_rows)
 
 
+def load_faq() -> FaqIndex:
+    """FAQ index of the chatbot questions sheet."""
+
+    return load_faq_index(
+        io="../data/perguntas_chatbot_v1.xlsx",
+        column="perguntas",
+        fix_table=False,
+        strip_stopwords=False,
+    )
+
+
+def match_questions(user_questions: list[str], faq_index: FaqIndex) -> pd.DataFrame:
+    """Match user questions against the FAQ with every scorer."""
+
+    results = extract_top_k(
+        faq_index.prepare_queries(user_questions),
+        faq_index.processed,
+        SCORERS,
+        limit=1,
+        labels=faq_index.raw,
+    )
+
+    return create_dataframe(user_questions, results)
+
+
+def open_text(path: str, mode: str = "r"):
+    """Open a text file, where "-" stands for stdin or stdout."""
+
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def read_questions(path: str, field: str) -> Iterator[str]:
+    """Yield questions one at a time from stdin ("-", one question per line),
+    a JSONL file or a CSV file, without loading the whole input. Empty and
+    non-string values (numbers, null) are skipped."""
+
+    with open_text(path) as f:
+        if path.endswith(".jsonl"):
+            questions = (json.loads(line).get(field) for line in f if line.strip())
+        elif path.endswith(".csv"):
+            questions = (row.get(field) for row in csv.DictReader(f))
+        else:
+            questions = (line.rstrip("\n") for line in f)
+
+        for question in questions:
+            if isinstance(question, str) and question.strip():
+                yield question
+
+
+def stream(input_path: str, output_path: str, field: str, batch_size: int) -> None:
+    """Match questions in micro-batches of `batch_size`, appending each batch to
+    the output (CSV, or JSONL when the path ends in .jsonl) as soon as it is ready."""
+
+    faq_index = load_faq()
+
+    with open_text(output_path, "w") as sink:
+        for n_batch, batch in enumerate(batched(read_questions(input_path, field), batch_size)):
+            df = match_questions(list(batch), faq_index)
+
+            if output_path.endswith(".jsonl"):
+                df.to_json(sink, orient="records", lines=True, force_ascii=False)
+            else:
+                df.to_csv(sink, header=n_batch == 0, index=False)
+
+            sink.flush()
+
+
 def main():
-    user_questions = pd.read_excel(io="../data/mapeamento_de_perguntas_chatbot.xlsx")
-    questions_df = pd.read_excel(io="../data/perguntas_chatbot_v1.xlsx")
+    user_questions = read_excel_cached(io="../data/mapeamento_de_perguntas_chatbot.xlsx")
+    faq_index = load_faq()
 
     user_questions = user_questions["PERGUNTA"].tolist()
-    questions_faq = questions_df["perguntas"].tolist()
-
-    scoares = (
-        fuzz.ratio,
-        fuzz.partial_ratio,
-        fuzz.token_set_ratio,
-        fuzz.partial_token_set_ratio,
-        fuzz.token_sort_ratio,
-        fuzz.partial_token_sort_ratio,
-        fuzz.token_ratio,
-        fuzz.partial_token_ratio,
-        fuzz.WRatio,
-    )
 
-    results = []
-
-    for i in user_questions:
-        results.append(
-            {
-                score.__name__: process.extract(
-                    i,
-                    questions_faq,
-                    scorer=score,
-                    limit=1,
-                    processor=utils.default_process,
-                )
-                for score in scoares
-            }
-        )
-
-    df = create_dataframe(user_questions, results)
+    df = match_questions(user_questions, faq_index)
     df.to_csv("output.csv", index=False)
 
 
-main()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match user questions against the FAQ.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream questions from --input instead of reading the whole mapping sheet.",
+    )
+    parser.add_argument("--input", default="-", help="stdin ('-'), a .jsonl or a .csv file.")
+    parser.add_argument("--output", default="-", help="stdout ('-'), a .csv or a .jsonl file.")
+    parser.add_argument(
+        "--field", default="PERGUNTA", help="JSONL key or CSV column holding the question."
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.stream:
+        stream(args.input, args.output, args.field, args.batch_size)
+    else:
+        main()
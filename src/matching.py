@@ -0,0 +1,265 @@
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from rapidfuzz import process
+
+Scorer = Callable[..., float]
+Processor = Callable[[str], str]
+
+
+def score_matrices(
+    queries: Sequence[str],
+    choices: Sequence[str],
+    scorers: Sequence[Scorer],
+    processor: Processor | None = None,
+    workers: int = -1,
+) -> dict[str, np.ndarray]:
+    """Build the full (queries x choices) score matrix of every scorer with
+    `process.cdist`. The processor runs once per string, not once per scorer."""
+
+    if processor is not None:
+        queries = [processor(query) for query in queries]
+        choices = [processor(choice) for choice in choices]
+
+    return {
+        scorer.__name__: process.cdist(
+            queries, choices, scorer=scorer, processor=None, dtype=np.float64, workers=workers
+        )
+        for scorer in scorers
+    }
+
+
+def candidate_score_matrices(
+    queries: Sequence[str],
+    choices: Sequence[str],
+    scorers: Sequence[Scorer],
+    candidates: np.ndarray,
+    workers: int = -1,
+) -> dict[str, np.ndarray]:
+    """Score each query only against its shortlisted choices with `process.cpdist`.
+
+    `candidates` is an (N x K) array of choice indices padded with -1; the
+    returned (N x K) matrices hold -1 in the padded positions."""
+
+    rows, cols = np.nonzero(candidates >= 0)
+    pair_queries = [queries[row] for row in rows]
+    pair_choices = [choices[idx] for idx in candidates[rows, cols]]
+
+    matrices = {}
+    for scorer in scorers:
+        matrix = np.full(candidates.shape, -1.0, dtype=np.float64)
+        matrix[rows, cols] = process.cpdist(
+            pair_queries, pair_choices, scorer=scorer, dtype=np.float64, workers=workers
+        )
+        matrices[scorer.__name__] = matrix
+
+    return matrices
+
+
+def top_k(matrix: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return the (N x limit) indices and scores of the best choices of each row.
+
+    Ties are broken by choice position, the same order `process.extract` uses."""
+
+    limit = min(limit, matrix.shape[1])
+    indices = np.argsort(-matrix, axis=1, kind="stable")[:, :limit]
+    scores = np.take_along_axis(matrix, indices, axis=1)
+
+    return indices, scores
+
+
+@dataclass
+class SimilarityResults:
+    """Top-k matches of every scorer stored column-wise as (N x k) arrays.
+
+    `indices` holds 0-based choice positions, -1 marking an empty slot (fewer
+    candidates than k); `scores` holds the matching scores."""
+
+    indices: dict[str, np.ndarray]
+    scores: dict[str, np.ndarray]
+
+    @property
+    def methods(self) -> list[str]:
+        return list(self.indices)
+
+    def __len__(self) -> int:
+        return len(next(iter(self.indices.values()), ()))
+
+    @classmethod
+    def from_matches(
+        cls, results: list[dict[str, list[tuple[str, float, int]]]]
+    ) -> "SimilarityResults":
+        """Build from the `{scorer_name: [(choice, score, index)]}` dicts of `extract_top_k`."""
+
+        methods = results[0].keys() if results else []
+        limit = max((len(result[name]) for result in results for name in methods), default=0)
+
+        shape = (len(results), limit)
+        indices = {name: np.full(shape, -1, dtype=np.int64) for name in methods}
+        scores = {name: np.full(shape, np.nan, dtype=np.float64) for name in methods}
+
+        for row, result in enumerate(results):
+            for name in methods:
+                for rank, (_, score, idx) in enumerate(result[name]):
+                    indices[name][row, rank] = idx
+                    scores[name][row, rank] = score
+
+        return cls(indices, scores)
+
+    def to_matches(self, labels: Sequence[str]) -> list[dict[str, list[tuple[str, float, int]]]]:
+        """Convert back to one `{scorer_name: [(choice, score, index)]}` dict per query."""
+
+        columns = {
+            name: (self.indices[name].tolist(), self.scores[name].tolist()) for name in self.methods
+        }
+
+        return [
+            {
+                name: [
+                    (labels[idx], score, idx)
+                    for idx, score in zip(indices[row], scores[row], strict=True)
+                    if idx >= 0
+                ]
+                for name, (indices, scores) in columns.items()
+            }
+            for row in range(len(self))
+        ]
+
+    def to_wide_frame(self, questions: Sequence[str]) -> pd.DataFrame:
+        """One row per question with `<method>_question` (1-based FAQ numbers) and
+        `<method>_value` list columns, the layout of `process_similarity_results`."""
+
+        columns = {"wpp_question": list(questions)}
+
+        for name in self.methods:
+            indices = self.indices[name]
+            faq_questions = (indices + 1).tolist()
+            values = np.round(self.scores[name], 2).tolist()
+
+            if (indices < 0).any():
+                faq_questions = [[idx for idx in row if idx > 0] for row in faq_questions]
+                values = [
+                    [value for value, idx in zip(row, idx_row, strict=True) if idx >= 0]
+                    for row, idx_row in zip(values, indices, strict=True)
+                ]
+
+            columns[f"{name}_question"] = faq_questions
+            columns[f"{name}_value"] = values
+
+        return pd.DataFrame(columns)
+
+    def to_long_frame(self, questions: Sequence[str] | None = None) -> pd.DataFrame:
+        """Tidy frame with one row per (question, method, rank) match, built
+        straight from the arrays without per-row Python objects."""
+
+        frames = []
+        for name in self.methods:
+            indices = self.indices[name]
+            rows, ranks = np.nonzero(indices >= 0)
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "row": rows,
+                        "similarity_method": name,
+                        "rank": ranks + 1,
+                        "faq_question": indices[rows, ranks] + 1,
+                        "score": self.scores[name][rows, ranks],
+                    }
+                )
+            )
+
+        df = pd.concat(frames, ignore_index=True)
+        df["similarity_method"] = pd.Categorical(df["similarity_method"], categories=self.methods)
+
+        if questions is not None:
+            df.insert(1, "wpp_question", np.asarray(questions, dtype=object)[df["row"].to_numpy()])
+
+        return df
+
+    def to_arrow(self, questions: Sequence[str] | None = None) -> pa.Table:
+        """Same layout as `to_long_frame`, as an Arrow table."""
+
+        return pa.Table.from_pandas(self.to_long_frame(questions), preserve_index=False)
+
+
+def match_top_k(
+    queries: Sequence[str],
+    choices: Sequence[str],
+    scorers: Sequence[Scorer],
+    limit: int = 1,
+    processor: Processor | None = None,
+    workers: int = -1,
+    candidates: np.ndarray | None = None,
+    chunk_size: int = 10_000,
+) -> SimilarityResults:
+    """Top-`limit` choices of every query for each scorer.
+
+    Queries are scored in blocks of `chunk_size` rows, and each block's top-k is
+    written into preallocated (N x limit) arrays, so the full score matrices never
+    coexist in memory. When `candidates` (see `InvertedIndex.shortlist`) is
+    given, only the shortlisted choices of each query are scored."""
+
+    if processor is not None:
+        queries = [processor(query) for query in queries]
+        choices = [processor(choice) for choice in choices]
+
+    width = len(choices) if candidates is None else candidates.shape[1]
+    limit = min(limit, width)
+    names = [scorer.__name__ for scorer in scorers]
+
+    results = SimilarityResults(
+        indices={name: np.full((len(queries), limit), -1, dtype=np.int64) for name in names},
+        scores={name: np.full((len(queries), limit), np.nan, dtype=np.float64) for name in names},
+    )
+
+    for start in range(0, len(queries), chunk_size):
+        block = slice(start, start + chunk_size)
+
+        if candidates is None:
+            matrices = score_matrices(queries[block], choices, scorers, workers=workers)
+        else:
+            matrices = candidate_score_matrices(
+                queries[block], choices, scorers, candidates[block], workers=workers
+            )
+
+        for name, matrix in matrices.items():
+            indices, scores = top_k(matrix, limit)
+            if candidates is not None:
+                indices = np.take_along_axis(candidates[block], indices, axis=1)
+            results.indices[name][block] = indices
+            results.scores[name][block] = scores
+
+    return results
+
+
+def extract_top_k(
+    queries: Sequence[str],
+    choices: Sequence[str],
+    scorers: Sequence[Scorer],
+    limit: int = 1,
+    processor: Processor | None = None,
+    workers: int = -1,
+    labels: Sequence[str] | None = None,
+    candidates: np.ndarray | None = None,
+) -> list[dict[str, list[tuple[str, float, int]]]]:
+    """Vectorized replacement for calling `process.extract` once per query and scorer.
+
+    Returns one `{scorer_name: [(choice, score, index)]}` dict per query. `labels`
+    replaces the reported choice text, e.g. the raw FAQ question when matching a
+    `FaqIndex`. Prefer `match_top_k` for large inputs: it avoids building one
+    Python object per match."""
+
+    results = match_top_k(
+        queries,
+        choices,
+        scorers,
+        limit=limit,
+        processor=processor,
+        workers=workers,
+        candidates=candidates,
+    )
+
+    return results.to_matches(choices if labels is None else labels)
@@ -1,9 +1,21 @@
+import csv
+import hashlib
+import os
 import re
+from dataclasses import dataclass
+from functools import cache, lru_cache
 
 import nltk
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from nltk.corpus import stopwords
 
+from matching import SimilarityResults
+
+ACRONYMS_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "acronyms.csv")
+
 
 def fix_excel_table(df: pd.DataFrame) -> pd.DataFrame:
     """Apply fixes such as renaming columns and changing data
@@ -26,30 +38,115 @@ def fix_excel_table(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def remove_stopwords(strings: list[str]) -> list[str]:
-    """Removes Portuguese stopwords, greetings and punctuation (except ?)
-    from a list of strings."""
+def file_hash(path: str) -> str:
+    """SHA-256 of the file contents."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_excel_cached(
+    io: str,
+    sheet_name: str | int = 0,
+    fix_table: bool = False,
+    as_arrow: bool = False,
+    cache_dir: str | None = None,
+) -> pd.DataFrame | pa.Table:
+    """Read an Excel sheet through a Parquet copy kept under a .cache directory
+    next to the workbook, optionally with `fix_excel_table` already applied.
+
+    The copy is rebuilt whenever the workbook contents change. Object columns
+    mixing types (e.g. annotations holding both 12 and "12; 13") are stored
+    as strings, since Parquet columns have a single type."""
+
+    key = f"{file_hash(io)}:{sheet_name}:{fix_table}".encode()
+
+    cache_dir = cache_dir or os.path.join(os.path.dirname(io), ".cache")
+    source_name = os.path.splitext(os.path.basename(io))[0]
+    suffix = "_fixed" if fix_table else ""
+    cache_path = os.path.join(cache_dir, f"{source_name}_{sheet_name}{suffix}.parquet")
+
+    if os.path.exists(cache_path) and pq.read_schema(cache_path).metadata.get(b"source_key") == key:
+        table = pq.read_table(cache_path)
+    else:
+        df = pd.read_excel(io=io, sheet_name=sheet_name)
+        if fix_table:
+            df = fix_excel_table(df)
+
+        for column in df.select_dtypes(include="object").columns:
+            if df[column].dropna().map(type).nunique() > 1:
+                df[column] = df[column].map(str, na_action="ignore")
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**table.schema.metadata, b"source_key": key})
+
+        os.makedirs(cache_dir, exist_ok=True)
+        pq.write_table(table, f"{cache_path}.tmp")
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    return table if as_arrow else table.to_pandas()
+
+
+GREETINGS = ("bom dia", "boa tarde", "boa noite")
+
+# Greetings (with an optional trailing !.,) and every punctuation sign but "?"
+# are removed by a single substitution.
+NOISE_PATTERN = re.compile(
+    "|".join(f"{re.escape(greeting)}[!.,]?" for greeting in GREETINGS) + r"|[^\w\s\?]"
+)
+
+
+@cache
+def portuguese_stopwords() -> frozenset[str]:
+    """NLTK Portuguese stopwords, downloaded on first use if needed."""
 
     try:
-        stop_words = set(stopwords.words("portuguese"))
+        return frozenset(stopwords.words("portuguese"))
     except LookupError:
         nltk.download("stopwords", quiet=True)
-        stop_words = set(stopwords.words("portuguese"))
+        return frozenset(stopwords.words("portuguese"))
 
-    greetings = {"bom dia", "boa tarde", "boa noite"}
 
-    def clean_text(text: str) -> str:
-        text_lower = text.lower()
-        for greeting in greetings:
-            text_lower = re.sub(f"{greeting}[!.,]?", "", text_lower)
-        text_lower = re.sub(r"[^\w\s\?]", "", text_lower)
-        return " ".join(
-            word for word in text_lower.split() if word not in stop_words and word.strip()
-        ).strip()
+@lru_cache(maxsize=65536)
+def clean_text(text: str) -> str:
+    """Removes Portuguese stopwords, greetings and punctuation (except ?)
+    from a string. Results are memoized since WhatsApp messages repeat a lot."""
+
+    stop_words = portuguese_stopwords()
+    text = NOISE_PATTERN.sub("", text.lower())
+
+    return " ".join(word for word in text.split() if word not in stop_words)
+
+
+def remove_stopwords(strings: list[str]) -> list[str]:
+    """Removes Portuguese stopwords, greetings and punctuation (except ?)
+    from a list of strings."""
 
     return [clean_text(text) for text in strings]
 
 
+def remove_stopwords_batch(texts: pd.Series | np.ndarray) -> pd.Series | np.ndarray:
+    """Batch version of `remove_stopwords` for pandas Series and NumPy string arrays.
+
+    Each distinct text is cleaned once; missing values are kept as they are."""
+
+    values = texts.to_numpy(dtype=object) if isinstance(texts, pd.Series) else np.asarray(texts)
+    codes, uniques = pd.factorize(values)
+
+    cleaned = np.array([clean_text(str(text)) for text in uniques], dtype=object)
+
+    result = values.astype(object)
+    found = codes >= 0
+    result[found] = cleaned[codes[found]]
+
+    if isinstance(texts, pd.Series):
+        return pd.Series(result, index=texts.index, name=texts.name)
+    return result.astype(str) if values.dtype.kind in "US" else result
+
+
 def process_similarity_results(
     wpp_questions: list[str], results: list[dict[str, list[tuple[str, float, int]]]]
 ) -> pd.DataFrame:
@@ -57,67 +154,120 @@ def process_similarity_results(
     Process similarity results into a structured DataFrame with dynamic scoring methods,
     handling multiple matches per scoring method
     """
-    processed_data = []
-    scoring_methods = results[0].keys()
 
-    for question, result in zip(wpp_questions, results, strict=False):
-        row_data = {"wpp_question": question}
+    return SimilarityResults.from_matches(results).to_wide_frame(wpp_questions)
 
-        for score_name in scoring_methods:
-            matches = result[score_name]
 
-            indices = [match[2] + 1 for match in matches]
-            scores = [round(match[1], 2) for match in matches]
+@dataclass
+class GroundTruth:
+    """Annotations of a sheet exploded into one (row, faq) pair per accepted answer.
 
-            row_data[f"{score_name}_question"] = indices
-            row_data[f"{score_name}_value"] = scores
+    `row` is the position of the question among the annotated rows of the sheet,
+    so the same object can be reused across many calls to `evaluate_rankings`."""
 
-        processed_data.append(row_data)
+    pairs: pd.DataFrame
+    index: pd.Index
+    n_wpp_questions: list[int]
 
-    df = pd.DataFrame(processed_data)
 
-    columns = ["wpp_question"]
+def ground_truth(df: pd.DataFrame) -> GroundTruth:
+    """Build the ground truth of the annotated rows of `df`."""
 
-    for score_name in scoring_methods:
-        columns.extend([f"{score_name}_question", f"{score_name}_value"])
+    valid_df = df[
+        ~pd.isna(df["wpp_to_faq_annotation"]) & (df["wpp_to_faq_annotation"].str.lower() != "none")
+    ]
 
-    return df[columns]
+    faq = valid_df["wpp_to_faq_annotation"].astype(str).str.split(";")
+    faq = faq.set_axis(np.arange(len(valid_df))).explode().str.strip()
 
+    return GroundTruth(
+        pairs=pd.DataFrame({"row": faq.index.to_numpy(), "faq": faq.to_numpy()}).drop_duplicates(),
+        index=valid_df.index,
+        n_wpp_questions=valid_df["n_wpp_questions"].astype(int).tolist(),
+    )
 
-def calculate_scores(df: pd.DataFrame) -> pd.DataFrame:
-    """Calculate the score of each similarity method."""
 
-    similarity_columns = [
-        col for col in df.columns if col.endswith("_question") and col != "wpp_question"
-    ]
-    results = []
+def evaluate_rankings(
+    df: pd.DataFrame, k: int | None = None, truth: GroundTruth | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Evaluate every similarity method of `df` against the annotations in one pass.
 
-    valid_df = df[
-        ~pd.isna(df["wpp_to_faq_annotation"]) & (df["wpp_to_faq_annotation"].str.lower() != "none")
-    ]
+    Each `<method>_question` column holds a prediction or a ranked list of
+    predictions. Returns:
+      - metrics: one row per method with accuracy (a hit anywhere in the list),
+        recall@1..k, MRR and the hit questions.
+      - ranks: (annotated questions x methods) rank of the first correct
+        prediction, 0 when there is none; `ranks > 0` is the per-question hit mask.
+    """
 
-    ground_truth_sets = valid_df["wpp_to_faq_annotation"].apply(
-        lambda x: set(map(str.strip, str(x).split(";")))
+    truth = ground_truth(df) if truth is None else truth
+    valid_df = df.loc[truth.index]
+
+    methods = [col for col in df.columns if col.endswith("_question") and col != "wpp_question"]
+
+    predictions = []
+    for method in methods:
+        pred = valid_df[method].set_axis(np.arange(len(valid_df)))
+        pred = pred.map(lambda p: p if isinstance(p, list) else [p]).explode().dropna()
+        predictions.append(
+            pd.DataFrame(
+                {
+                    "method": method.replace("_question", ""),
+                    "row": pred.index.to_numpy(),
+                    "rank": pred.groupby(level=0).cumcount().to_numpy() + 1,
+                    "faq": pred.astype(str).to_numpy(),
+                }
+            )
+        )
+
+    method_names = [method.replace("_question", "") for method in methods]
+    hits = pd.concat(predictions, ignore_index=True).merge(truth.pairs, on=["row", "faq"])
+    ranks = (
+        hits.groupby(["row", "method"])["rank"]
+        .min()
+        .unstack("method")
+        .reindex(index=np.arange(len(valid_df)), columns=method_names)
+        .fillna(0)
+        .astype(int)
+    )
+    ranks.index = pd.Index(truth.n_wpp_questions, name="n_wpp_questions")
+    ranks.columns.name = None
+
+    rank_values = ranks.to_numpy()
+    hit_mask = rank_values > 0
+    k = k or max(int(rank_values.max(initial=0)), 1)
+    reciprocal_ranks = np.divide(1.0, rank_values, out=np.zeros(rank_values.shape), where=hit_mask)
+
+    metrics = pd.DataFrame(
+        {
+            "similarity_method": method_names,
+            "accuracy": hit_mask.mean(axis=0),
+            **{
+                f"recall@{j}": (hit_mask & (rank_values <= j)).mean(axis=0)
+                for j in range(1, k + 1)
+            },
+            "mrr": reciprocal_ranks.mean(axis=0),
+            "total_questions": len(valid_df),
+            "right_questions": [ranks.index[hit_mask[:, j]].tolist() for j in range(len(methods))],
+        }
     )
 
-    for method in similarity_columns:
-        predictions = valid_df[method].astype(str)
-        correct_questions = []
-
-        for idx, (pred, gt_set) in enumerate(zip(predictions, ground_truth_sets, strict=False)):
-            if pred in gt_set:
-                correct_questions.append(int(valid_df.iloc[idx]["n_wpp_questions"]))
-
-        method_name = method.replace("_question", "")
-        results.append(
-            {
-                "similarity_method": method_name,
-                "score": len(correct_questions),
-                "right_questions": correct_questions,
-            }
-        )
+    return metrics, ranks
 
-    results_df = pd.DataFrame(results)
+
+def calculate_scores(df: pd.DataFrame) -> pd.DataFrame:
+    """Calculate the score of each similarity method."""
+
+    _, ranks = evaluate_rankings(df, k=1)
+    top_hits = ranks == 1
+
+    results_df = pd.DataFrame(
+        {
+            "similarity_method": ranks.columns,
+            "score": top_hits.sum(axis=0).to_numpy(),
+            "right_questions": [ranks.index[top_hits[col]].tolist() for col in ranks.columns],
+        }
+    )
     results_df = results_df.sort_values("score", ascending=False)
 
     return results_df
@@ -126,73 +276,77 @@ def calculate_scores(df: pd.DataFrame) -> pd.DataFrame:
 def calculate_list_scores(df: pd.DataFrame) -> pd.DataFrame:
     """Calculate the score of each similarity method."""
 
-    similarity_columns = [
-        col for col in df.columns if col.endswith("_question") and col != "wpp_question"
-    ]
-    results = []
+    metrics, _ = evaluate_rankings(df, k=1)
 
-    valid_df = df[
-        ~pd.isna(df["wpp_to_faq_annotation"]) & (df["wpp_to_faq_annotation"].str.lower() != "none")
-    ]
+    results_df = metrics[["similarity_method", "accuracy", "total_questions", "right_questions"]]
+    results_df = results_df.assign(accuracy=results_df["accuracy"].round(3))
+    results_df = results_df.sort_values("accuracy", ascending=False)
 
-    ground_truth_sets = valid_df["wpp_to_faq_annotation"].apply(
-        lambda x: set(map(str.strip, str(x).split(";")))
-    )
+    return results_df
 
-    def parse_prediction(pred):
-        try:
-            if isinstance(pred, list):
-                return [str(p) for p in pred]
-        except Exception:
-            return [str(pred)]
-
-    for method in similarity_columns:
-        predictions = valid_df[method]
-        correct_questions = []
-
-        for idx, (pred, gt_set) in enumerate(zip(predictions, ground_truth_sets, strict=False)):
-            pred_list = parse_prediction(pred)
-            if any(p in gt_set for p in pred_list):
-                correct_questions.append(int(valid_df.iloc[idx]["n_wpp_questions"]))
-
-        method_name = method.replace("_question", "")
-        results.append(
-            {
-                "similarity_method": method_name,
-                "accuracy": round(len(correct_questions) / len(ground_truth_sets), 3),
-                "total_questions": len(ground_truth_sets),
-                "right_questions": correct_questions,
-            }
-        )
 
-    results_df = pd.DataFrame(results)
-    results_df = results_df.sort_values("accuracy", ascending=False)
+def load_acronyms(path: str = ACRONYMS_PATH) -> dict[str, str]:
+    """Read the acronym dictionary, a CSV file with `acronym` and `description` columns."""
 
-    return results_df
+    with open(path, encoding="utf-8", newline="") as f:
+        return {row["acronym"].strip().upper(): row["description"] for row in csv.DictReader(f)}
+
+
+def trie_pattern(words: list[str]) -> str:
+    """Regex alternation of `words` factored as a prefix trie, so matching cost
+    depends on the length of the words rather than on how many there are."""
+
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def to_pattern(node: dict) -> str:
+        branches = [re.escape(char) + to_pattern(node[char]) for char in sorted(node) if char]
+        if not branches:
+            return ""
+
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # Greedy optional suffix: prefer the longest acronym sharing this prefix.
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return to_pattern(trie)
+
+
+@cache
+def acronym_matcher(path: str = ACRONYMS_PATH) -> tuple[re.Pattern, dict[str, str]]:
+    """Compiled single-pass matcher and dictionary for the acronyms in `path`."""
+
+    acronyms = load_acronyms(path)
+    pattern = re.compile(r"\b" + trie_pattern(list(acronyms)) + r"\b", re.IGNORECASE)
+
+    return pattern, acronyms
+
+
+def expand_acronyms(text: str, path: str = ACRONYMS_PATH) -> str:
+    """Replace the first occurrence of each acronym in `text` with its full description."""
+
+    pattern, acronyms = acronym_matcher(path)
+    seen = set()
 
+    def expand(match: re.Match) -> str:
+        acronym = match.group().upper()
+        if acronym in seen:
+            return match.group()
+        seen.add(acronym)
+        return acronyms[acronym]
 
-def replace_acronyms(text_list: list[str]) -> list[str]:
-    """Replace acronyms in a list of strings with their full descriptions"""
+    return pattern.sub(expand, text)
 
-    acronym_dict = {
-        "ASPLO": "Assessorias Setoriais de Planejamento e Orçamento (ASPLO)",
-        "SIPLAG": "Sistema de Inteligência em Planejamento e Gestão (SIPLAG)",
-        "REDEPLAN": "Rede de Planejamento (REDEPLAN)",
-        "PPA": "Plano Plurianual (PPA)",
-        "SUPLAN": "Superintendência de Planejamento (SUPLAN)",
-        "SUBPLO": "Subsecretaria de Planejamento e Orçamento (SUBPLO)",
-    }
 
-    patterns = {
-        acronym: re.compile(r"\b" + re.escape(acronym) + r"\b", re.IGNORECASE)
-        for acronym in sorted(acronym_dict, key=len, reverse=True)
-    }
+def replace_acronyms(
+    text_list: list[str] | pd.Series, path: str = ACRONYMS_PATH
+) -> list[str] | pd.Series:
+    """Replace acronyms in a list (or Series) of strings with their full descriptions"""
 
-    result_list = []
-    for text in text_list:
-        result = text
-        for acronym, pattern in patterns.items():
-            result = pattern.sub(acronym_dict[acronym], result, 1)
-        result_list.append(result)
+    if isinstance(text_list, pd.Series):
+        return text_list.map(lambda text: expand_acronyms(text, path), na_action="ignore")
 
-    return result_list
+    return [expand_acronyms(text, path) for text in text_list]